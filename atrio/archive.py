@@ -0,0 +1,139 @@
+import io
+import json
+import os
+import time
+import zipfile
+
+from .trio import *
+
+
+class Archive:
+    """ Single file backup of the programs of many controllers, storing identical programs once.
+
+    The archive is a zip file (so any program can be read without unpacking the others) containing:
+      programs/<crc>-<n>                   program bodies, named by their trio CRC
+                                           (n distinguishes different programs with the same CRC)
+      controllers/<name>.json              one manifest per controller:
+          { name: <name>, ip: <ip>, time: <unix time>,
+            files: [ { filename: <progname.ext>, autorun: <autorun>, crc: <crc>, blob: <programs/..> } ] }
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _zip(self, mode='r'):
+        return zipfile.ZipFile(self.path, mode, compression=zipfile.ZIP_DEFLATED)
+
+    def controllers(self):
+        if not os.path.exists(self.path):
+            return []
+        with self._zip() as z:
+            return sorted(n[len('controllers/'):-len('.json')] for n in z.namelist()
+                          if n.startswith('controllers/'))
+
+    def manifest(self, name, z=None):
+        """ Manifest of controller name, read from z (the opened archive) when given """
+        if z is None:
+            with self._zip() as z:
+                return self.manifest(name, z)
+        try:
+            return json.loads(z.read('controllers/{}.json'.format(name)).decode())
+        except KeyError:
+            raise AtrioError("Controller {} is not in archive {}".format(name, self.path))
+
+    @staticmethod
+    def open_blob(z, blob):
+        """ Returns a text file object streaming program body blob of z (the opened archive) """
+        return io.TextIOWrapper(z.open(blob), encoding='utf-8', newline=None)
+
+    def read_program(self, name, filename):
+        with self._zip() as z:
+            m = self.manifest(name, z)
+            f = next((f for f in m['files'] if f['filename'].upper() == filename.upper()), None)
+            if f is None:
+                raise AtrioError("Program {} is not in the archive of {}".format(filename, name))
+            with self.open_blob(z, f['blob']) as lines:
+                return lines.read()
+
+    def add_controller(self, trio, name=None):
+        """ Download all the programs of trio and store them as controller name (default trio ip).
+        Programs already in the archive are not stored again. Replaces a previous manifest of name.
+        :returns the manifest and the number of new program bodies stored
+        """
+        name = name or trio.name
+        if name in self.controllers():
+            self._remove_manifest(name)
+        with self._zip('a') as z:
+            blobs = {}
+            for n in z.namelist():
+                if n.startswith('programs/'):
+                    blobs.setdefault(int(n.split('/')[1].split('-')[0], 16), []).append(n)
+            files = []
+            new_blobs = 0
+            for ll in trio.list_files().values():
+                if ll['codetype'] == "Project":
+                    continue
+                lines = [l.encode('utf-8') for l in trio.read_program(ll['progname']).splitlines()]
+                crc = crc_lines(lines)
+                body = b''.join(l + b'\r\n' for l in lines)
+                blob = next((b for b in blobs.get(crc, []) if z.read(b) == body), None)
+                if blob is None:
+                    blob = 'programs/{:04x}-{}'.format(crc, len(blobs.get(crc, [])))
+                    z.writestr(blob, body)
+                    blobs.setdefault(crc, []).append(blob)
+                    new_blobs += 1
+                files.append({'filename': ll['progname'] + extension_from_code_type(ll['codetype']),
+                              'autorun': ll['autorun'], 'crc': crc, 'blob': blob})
+            manifest = {'name': name, 'ip': trio.ip, 'time': time.time(), 'files': files}
+            z.writestr('controllers/{}.json'.format(name), json.dumps(manifest, indent=1))
+        return manifest, new_blobs
+
+    def _remove_manifest(self, name):
+        """ Zip files cannot delete entries, rewrite the archive without the manifest of name
+        and the program bodies only it was using.
+        """
+        tmp = self.path + '.tmp'
+        with self._zip() as src, zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as dst:
+            referenced = set()
+            for c in self.controllers():
+                if c != name:
+                    referenced.update(f['blob'] for f in self.manifest(c, src)['files'])
+            for info in src.infolist():
+                if info.filename == 'controllers/{}.json'.format(name):
+                    continue
+                if info.filename.startswith('programs/') and info.filename not in referenced:
+                    continue
+                dst.writestr(info, src.read(info.filename))
+        os.replace(tmp, self.path)
+
+    def restore_controller(self, trio, name, clear=False):
+        """ Write all the programs of controller name to trio, streaming them from the archive.
+        Programs are halted first, MC_CONFIG is written before the other programs.
+        :returns the reasons why a restart is needed (MC_CONFIG or autoruns restored), like `Workspace.plan_deploy`
+        """
+        trio.halt()  # Trio will fail when there are running progs and we write some
+        restart_reasons = []
+        with self._zip() as z:
+            m = self.manifest(name, z)
+            if clear:
+                trio.commandS('NEW "ALL"')
+            files = sorted(m['files'], key=lambda f: program_from_filename(f['filename'])[1] != program_types['.MCC'])
+            for f in files:
+                progname, prog_type = program_from_filename(f['filename'])
+                print("Writing {}".format(f['filename']))
+                with self.open_blob(z, f['blob']) as lines:
+                    trio.write_program(progname, prog_type, lines)
+                if prog_type == program_types['.MCC']:
+                    restart_reasons.append("change of {}".format(f['filename']))
+                elif prog_type == program_types['.BAS']:
+                    trio.autorun_program(progname, f['autorun'])
+                    if f['autorun'] is not None:
+                        restart_reasons.append("autorun of {}".format(f['filename']))
+        return restart_reasons
+
+    def stats(self):
+        """ Returns (number of program references in manifests, number of stored program bodies) """
+        with self._zip() as z:
+            names = z.namelist()
+            refs = sum(len(self.manifest(n[len('controllers/'):-len('.json')], z)['files'])
+                       for n in names if n.startswith('controllers/'))
+        return refs, sum(1 for n in names if n.startswith('programs/'))
@@ -0,0 +1,108 @@
+""" Shell completion helpers for the `atrio` command line (used through argcomplete).
+
+Completion must be fast and never touch the network: the program names of a
+controller come from an on-disk cache keyed by controller ip. When the cache is
+missing or older than `CACHE_TTL`, a refresh is started in the background
+(`python -m atrio.completion <ip>`) and the current (possibly stale) content is used.
+"""
+
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+CACHE_TTL = 300  # seconds
+
+# Do not start a new background refresh if one was started less than this ago
+REFRESH_GRACE = 30  # seconds
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or str(Path.home() / '.cache')
+    return Path(base) / 'atrio'
+
+
+def cache_file(ip):
+    return cache_dir() / 'progs-{}.json'.format(re.sub(r'[^\w.\-]', '_', ip))
+
+
+def read_cache(ip):
+    """ Returns (timestamp, [program filenames]) or None if there is no cache for ip """
+    import json
+    try:
+        with open(cache_file(ip)) as f:
+            c = json.load(f)
+        return c['time'], c['programs']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cache(ip, list_files):
+    """ Save the result of `Trio.list_files()` as the program cache of ip """
+    import json
+    from .trio import extension_from_code_type
+    programs = [ll['progname'] + extension_from_code_type(ll['codetype'])
+                for ll in list_files.values() if ll['codetype'] != "Project"]
+    f = cache_file(ip)
+    f.parent.mkdir(parents=True, exist_ok=True)
+    tmp = f.with_name(f.name + '.{}.tmp'.format(os.getpid()))
+    with open(tmp, 'w') as out:
+        json.dump({'ip': ip, 'time': time.time(), 'programs': programs}, out)
+    os.replace(str(tmp), str(f))
+
+
+def refresh(ip):
+    """ Connect to the controller and update its program cache """
+    from .trio import Trio
+    with Trio(ip) as t:
+        write_cache(ip, t.list_files())
+
+
+def refresh_in_background(ip):
+    """ Start a detached process refreshing the cache of ip, unless one was started recently """
+    marker = cache_file(ip).with_suffix('.refreshing')
+    try:
+        if time.time() - marker.stat().st_mtime < REFRESH_GRACE:
+            return
+    except OSError:
+        pass
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.touch()
+    import subprocess
+    subprocess.Popen([sys.executable, '-m', 'atrio.completion', ip],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+def cached_programs(ip):
+    """ Program filenames of the controller from the cache, refreshing it in the background when stale """
+    c = read_cache(ip)
+    if c is None or time.time() - c[0] > CACHE_TTL:
+        refresh_in_background(ip)
+    return c[1] if c else []
+
+
+def match_case(prefix, names):
+    """ Trio is case insensitive, so complete with the case used by the prefix """
+    if prefix and prefix == prefix.lower() and prefix != prefix.upper():
+        return [n.lower() for n in names if n.lower().startswith(prefix)]
+    return [n for n in names if n.startswith(prefix.upper())]
+
+
+def program_completer(prefix, parsed_args, **kwargs):
+    ip = getattr(parsed_args, 'ip', None)
+    if not ip:
+        return []
+    return match_case(prefix, cached_programs(ip))
+
+
+def keyword_completer(prefix, **kwargs):
+    """ Complete the last keyword of prefix, so `?mp` gives `?mpos` """
+    from .tokens import keywords
+    head, word = re.match(r'^(.*?)([\w$]*)$', prefix).groups()
+    return [head + k for k in match_case(word, keywords())]
+
+
+if __name__ == "__main__":
+    refresh(sys.argv[1])
@@ -0,0 +1,134 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .trio import *
+from .workspace import Workspace
+
+
+def load_drives_file(drives_file):
+    """ Returns [{'name', 'ip', 'ws'}] from a yaml file describing controllers, either a list of
+    { ip: <ip>, name: <name>, ws: <workspace file> } or a mapping name -> { ip: <ip>, ws: <workspace file> }.
+    name defaults to the ip, ws is optional and relative to the drives file.
+    """
+    import yaml
+    with open(drives_file) as f:
+        drives = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    if isinstance(drives, dict):
+        drives = [dict(d, name=d.get('name', name)) for (name, d) in drives.items()]
+    controllers = []
+    for d in drives:
+        ws = d.get('ws')
+        if ws is not None:
+            ws = str(Path(drives_file).parent / ws)
+        controllers.append({'name': str(d.get('name', d['ip'])), 'ip': d['ip'], 'ws': ws})
+    return controllers
+
+
+def controller_status(trio, ws=None):
+    """ Read only status of trio, compared to the workspace ws when given (see `Workspace.controller_diff`) """
+    status = {
+        'version': trio.commandS("?VERSION"),
+        'checksum': trio.commandI("?CHECKSUM"),
+        'system_error': trio.system_error(),
+        'ethercat': trio.ethercat_state(),
+        'files': trio.list_files(),
+        'drift': [],
+    }
+    if ws is not None:
+        w = Workspace(trio)
+        w.ws, w.wsfiledir = ws
+        cdiff = w.controller_diff()
+        for k in ['missing', 'wrong_type', 'different', 'autorun_changed']:
+            if cdiff[k]:
+                status['drift'].append("{}: {}".format(k, ' '.join(Path(f).name for f in cdiff[k])))
+        if cdiff['extra_progs']:
+            status['drift'].append("extra: {}".format(' '.join(sorted(cdiff['extra_progs']))))
+        checksum = w.ws.get('controller', {}).get('checksum')
+        if checksum is not None and int(checksum) != status['checksum']:
+            status['drift'].append("checksum: {} expected".format(checksum))
+    if status['system_error']:
+        status['drift'].append("system error: {}".format(status['system_error']))
+    return status
+
+
+def connect_trio(ip, deadline):
+    """ Returns a Trio connected to ip, giving up at deadline (see `Trio.connect`) """
+    t = Trio(ip, auto_connect=False)
+    t.connect(deadline=deadline)
+    return t
+
+
+def fleet_status(controllers, jobs=32, timeout=20, connect=connect_trio):
+    """ Collect `controller_status` of all controllers in parallel (jobs at most at the same time).
+    A controller not done timeout seconds after its scan started (connection included) is aborted
+    (`Trio.abort`) and reported as timed out, so a scan takes about the time of the slowest controller
+    instead of the sum of all of them.
+    connect(ip, deadline) returns a Trio connected before deadline (a `time.monotonic()` time).
+    :returns {name: status}, status has an 'error' key when it could not be collected
+    """
+    import threading
+    workspaces = {}
+    for c in controllers:
+        if c['ws'] and c['ws'] not in workspaces:
+            w = Workspace(None)
+            w.load(c['ws'])
+            workspaces[c['ws']] = (w.ws, w.wsfiledir)
+
+    def scan(c):
+        start = time.monotonic()
+        try:
+            t = connect(c['ip'], start + timeout)
+        except ConnectionLost:
+            if time.monotonic() - start >= timeout:
+                raise AtrioError("timeout after {}s".format(timeout))
+            raise
+        aborted = threading.Event()
+
+        def abort():
+            aborted.set()
+            t.abort()
+        timer = threading.Timer(max(0, timeout - (time.monotonic() - start)), abort)
+        timer.start()
+        try:
+            s = controller_status(t, workspaces.get(c['ws']))
+        except Exception:
+            if not aborted.is_set():
+                raise
+        finally:
+            timer.cancel()
+            if t.t:
+                t.t.close()
+        if aborted.is_set():
+            raise AtrioError("timeout after {}s".format(timeout))
+        s['duration'] = time.monotonic() - start
+        return s
+
+    result = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(scan, c): c['name'] for c in controllers}
+        for f, name in futures.items():
+            try:
+                result[name] = f.result()
+            except Exception as e:
+                result[name] = {'error': str(e) if isinstance(e, AtrioError) else "{}: {}".format(type(e).__name__, e)}
+    return result
+
+
+def print_fleet_status(controllers, result):
+    """ Print one line per controller, returns the number of controllers with drift or errors """
+    print("{:<16} {:<16} {:<8} {:>8} {:<16} {:>6}  {}".format(
+        "NAME", "IP", "VERSION", "CHECKSUM", "ETHERCAT", "TIME", "DRIFT"))
+    drifting = 0
+    for c in controllers:
+        s = result[c['name']]
+        if 'error' in s:
+            drifting += 1
+            print("{:<16} {:<16} {:<8} {:>8} {:<16} {:>6}  {}".format(c['name'], c['ip'], '', '', '', '', s['error']))
+            continue
+        if s['drift']:
+            drifting += 1
+        print("{:<16} {:<16} {:<8} {:>8} {:<16} {:>5.1f}s  {}".format(
+            c['name'], c['ip'], s['version'], s['checksum'], s['ethercat'], s['duration'],
+            '; '.join(s['drift']) if s['drift'] else ('ok' if c['ws'] else '-')))
+    return drifting
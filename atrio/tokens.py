@@ -0,0 +1,54 @@
+""" Access to the trio keywords described in the `tokentable` file shipped with atrio.
+
+Lines of the table are like:
+    C57CONSTANT,0,0,0,2,0,0<cre>   (command/function)
+    V176MPOS,1<se>                  (parameter, the first field is 1 for axis parameters)
+    T8PLC_AR,4.00000                (constant)
+    M0AXIS,1,1,1                    (modifier)
+    S20EOX                          (syntax token)
+"""
+
+import re
+from collections import namedtuple
+from pathlib import Path
+
+tokentable_file = Path(__file__).parent / 'tokentable'
+
+Token = namedtuple('Token', ['kind', 'id', 'name', 'fields', 'flags'])
+
+token_regex = re.compile(r'^(?P<kind>[CVTMS])(?P<id>\d+)(?P<name>[^,<]+)(?P<fields>[^<]*)(<(?P<flags>\w*)>)?$')
+
+_tokentable = None
+
+
+def tokentable():
+    """ Returns {name: Token} of the trio tokentable, parsed on first use """
+    global _tokentable
+    if _tokentable is None:
+        table = {}
+        with open(tokentable_file) as f:
+            for line in f:
+                m = token_regex.match(line.strip())
+                if not m:
+                    continue
+                fields = tuple(x for x in m.group('fields').split(',') if x)
+                table[m.group('name')] = Token(m.group('kind'), int(m.group('id')), m.group('name'),
+                                               fields, m.group('flags') or '')
+        _tokentable = table
+    return _tokentable
+
+
+def keywords():
+    """ Names usable in a trio command line (commands, parameters, constants and modifiers) """
+    return [t.name for t in tokentable().values() if t.kind != 'S']
+
+
+def is_axis_parameter(name):
+    """ Parameters taking an AXIS() modifier, like MPOS or FE """
+    t = tokentable().get(name.upper())
+    return t is not None and t.kind == 'V' and t.fields[:1] == ('1',)
+
+
+def is_writable_parameter(name):
+    t = tokentable().get(name.upper())
+    return t is not None and t.kind == 'V' and 'w' in t.flags
@@ -0,0 +1,81 @@
+import json
+import sys
+import time
+
+from .trio import *
+
+
+class Top:
+    """ Live view of the controller processes and system load over one connection.
+
+    Each sample reads `PROCESS` and `SYSTEM_LOAD_MAX` (reset after each read, so it is the max
+    since the previous sample). On a terminal only the rows which changed are redrawn.
+    Samples can be appended to a log file as json lines.
+    """
+    def __init__(self, trio, interval=1.0, logfile=None, out=sys.stdout):
+        self.trio = trio
+        self.interval = interval
+        self.logfile = logfile
+        self.out = out
+        self.rows = []
+        self.peak_load = 0.0
+        self.spikes = 0
+
+    def sample(self):
+        load = self.trio.system_load()
+        processes = self.trio.processes()
+        self.peak_load = max(self.peak_load, load)
+        if load > system_load_limit:
+            self.spikes += 1
+        return {'time': time.time(), 'system_load': load, 'processes': list(processes.values())}
+
+    def format(self, sample):
+        load = sample['system_load']
+        rows = [
+            "{} - system load max {:5.1f}%{} (peak {:.1f}%, {} spike(s) above {}%)".format(
+                self.trio.name, load, " !!" if load > system_load_limit else "",
+                self.peak_load, self.spikes, system_load_limit),
+            "{:>4}  {:<16} {:<10} {:>6}".format("PROC", "PROGRAM", "STATUS", "LINE"),
+        ]
+        for p in sorted(sample['processes'], key=lambda p: p['process']):
+            rows.append("{:>4}  {:<16} {:<10} {:>6}".format(
+                p['process'], p['progname'] or '', p['status'],
+                '' if p['line'] is None else p['line']))
+        return rows
+
+    def draw(self, rows):
+        """ Redraw only the rows different from the previous draw (ANSI cursor moves) """
+        if not self.out.isatty():
+            print('\n'.join(rows), file=self.out)
+            return
+        if not self.rows:
+            self.out.write("\x1b[2J")
+        for i, row in enumerate(rows):
+            if i >= len(self.rows) or self.rows[i] != row:
+                self.out.write("\x1b[{};1H{}\x1b[K".format(i + 1, row))
+        for i in range(len(rows), len(self.rows)):
+            self.out.write("\x1b[{};1H\x1b[K".format(i + 1))
+        self.out.write("\x1b[{};1H".format(len(rows) + 1))
+        self.out.flush()
+        self.rows = rows
+
+    def log(self, sample):
+        if self.logfile:
+            with open(self.logfile, 'a') as f:
+                f.write(json.dumps(sample) + '\n')
+
+    def run(self, count=None):
+        """ Sample every interval seconds, count times or until interrupted """
+        n = 0
+        try:
+            while count is None or n < count:
+                start = time.monotonic()
+                sample = self.sample()
+                self.log(sample)
+                self.draw(self.format(sample))
+                n += 1
+                if count is None or n < count:
+                    time.sleep(max(0, self.interval - (time.monotonic() - start)))
+        except KeyboardInterrupt:
+            pass
+        return self.spikes
@@ -0,0 +1,80 @@
+""" Timeline profiling of atrio operations.
+
+When enabled (`atrio --profile trace.json`), nested spans are recorded:
+workspace operations -> files -> Trio methods -> commands sent on the wire.
+They are saved in the Chrome trace event format, to open in chrome://tracing or https://ui.perfetto.dev
+When disabled, spans cost a global lookup.
+"""
+
+import functools
+import os
+import threading
+import time
+
+_profiler = None
+
+
+class Profiler:
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+
+    def add(self, name, cat, start, end, args):
+        self.events.append({
+            'name': name, 'cat': cat, 'ph': 'X', 'pid': self.pid, 'tid': threading.get_ident(),
+            'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6, 'args': args,
+        })
+
+    def save(self, filename):
+        import json
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def enable():
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    p, _profiler = _profiler, None
+    return p
+
+
+class span:
+    """ Context manager recording a span named name in category cat, with args shown in the trace viewer """
+    __slots__ = ['name', 'cat', 'args', 'start']
+
+    def __init__(self, name, cat, **args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        if _profiler:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if _profiler and self.start is not None:
+            if exc_type:
+                self.args['error'] = repr(exc_value)
+            _profiler.add(self.name, self.cat, self.start, time.perf_counter(), self.args)
+        return False
+
+
+def traced(cat):
+    """ Decorator recording a span for each call of the function """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _profiler:
+                return f(*args, **kwargs)
+            with span(f.__qualname__, cat):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,184 @@
+""" Record and replay of the telnet transport of `Trio`.
+
+A session file is json lines: a header { version, ip, time } then one event per line
+{ t: <seconds since start>, op: open|send|recv, data: <bytes as latin-1 text> }.
+`RecordingTelnet` wraps a telnetlib.Telnet and saves everything sent and received,
+`ReplayTelnet` plays a session back to the same code, without a controller.
+"""
+
+import json
+import re
+import threading
+import time
+
+from .trio import AtrioError
+
+
+def _text(data):
+    return data.decode('latin-1')
+
+
+def _bytes(text):
+    return text.encode('latin-1')
+
+
+def session_ip(session_file):
+    """ ip of the controller a session was recorded with """
+    with open(session_file) as f:
+        return json.loads(f.readline()).get('ip')
+
+
+class RecordingTelnet:
+    """ Forward to a telnetlib.Telnet like object, recording the traffic in a session file """
+    def __init__(self, telnet, session_file, ip=None):
+        self.telnet = telnet
+        self.f = open(session_file, 'w')
+        self.origin = time.monotonic()
+        self.lock = threading.Lock()
+        self.f.write(json.dumps({'version': 1, 'ip': ip, 'time': time.time()}) + '\n')
+
+    def record(self, op, data=b''):
+        with self.lock:
+            if self.f.closed:
+                return
+            self.f.write(json.dumps({'t': round(time.monotonic() - self.origin, 6), 'op': op,
+                                     'data': _text(data)}) + '\n')
+            self.f.flush()
+
+    def open(self, host, *args, **kwargs):
+        self.record('open', host.encode())
+        return self.telnet.open(host, *args, **kwargs)
+
+    def close(self):
+        return self.telnet.close()
+
+    def end(self):
+        """ Close the session file, the connection can be closed and opened again until then """
+        with self.lock:
+            self.f.close()
+
+    def get_socket(self):
+        return self.telnet.get_socket()
+
+    def write(self, data):
+        self.record('send', data)
+        return self.telnet.write(data)
+
+    def expect(self, regexes, timeout=None):
+        index, match, text = self.telnet.expect(regexes, timeout)
+        self.record('recv', text)
+        return index, match, text
+
+    def read_some(self):
+        data = self.telnet.read_some()
+        if data:
+            self.record('recv', data)
+        return data
+
+
+class ReplayTelnet:
+    """ Play a recorded session back. Sent data must match the recording (except the random
+    number of the connection handshake), received data comes from the recording.
+    With timing, the recorded delays between events are reproduced.
+    """
+    def __init__(self, session_file, timing=False):
+        with open(session_file) as f:
+            self.header = json.loads(f.readline())
+            self.events = [json.loads(l) for l in f if l.strip()]
+        self.timing = timing
+        self.pos = 0
+        self.substitutions = []
+        self.handshake = False  # Between open and ?MPE, see `Trio.connect`
+        self.cond = threading.Condition()
+        self.last = None  # (recorded time, real time) of the last event
+
+    @property
+    def ip(self):
+        return self.header.get('ip')
+
+    def _next(self, op, timeout=None, wait=True):
+        """ Returns the next event, which must be op, and moves on.
+        If wait, waits up to timeout for other threads (the output reader) to consume the events before it,
+        otherwise a next event of another op raises EOFError, like a dropped connection.
+        Returns None at the end of the session, or if the recorded delay exceeds timeout (with timing).
+        """
+        with self.cond:
+            if wait and not self.cond.wait_for(
+                    lambda: self.pos >= len(self.events) or self.events[self.pos]['op'] == op, timeout):
+                return None
+            if self.pos >= len(self.events):
+                return None
+            e = self.events[self.pos]
+            if e['op'] != op:
+                raise EOFError("Replay session has {} where {} was expected".format(e['op'], op))
+            if self.timing and self.last:
+                delay = (e['t'] - self.last[0]) - (time.monotonic() - self.last[1])
+                if delay > 0:
+                    if timeout is not None and delay > timeout:
+                        time.sleep(timeout)
+                        return None
+                    time.sleep(delay)
+            self.last = (e['t'], time.monotonic())
+            self.pos += 1
+            self.cond.notify_all()
+            return e
+
+    def open(self, host, *args, **kwargs):
+        if self._next('open', timeout=5) is None:
+            raise EOFError("Replay session {} has no more connection".format(host))
+        self.handshake = True
+
+    def close(self):
+        pass
+
+    def end(self):
+        pass
+
+    def get_socket(self):
+        return None
+
+    def write(self, data):
+        e = self._next('send', timeout=5)
+        if e is None:
+            raise EOFError("Replay session ended, cannot send {}".format(repr(data)))
+        recorded = _bytes(e['data'])
+        if recorded == b'?MPE\r\n':
+            self.handshake = False
+        if recorded != data:
+            handshake = rb'\?\d+\r\n'
+            if self.handshake and re.fullmatch(handshake, recorded) and re.fullmatch(handshake, data):
+                self.substitutions.append((recorded[1:-2], data[1:-2]))
+            else:
+                raise AtrioError("Replay diverged: sent {} but {} was recorded".format(repr(data), repr(recorded)))
+
+    def _recv(self, timeout=None, wait=True):
+        e = self._next('recv', timeout, wait)
+        if e is None:
+            return None
+        data = _bytes(e['data'])
+        for (recorded, actual) in self.substitutions:
+            data = data.replace(recorded, actual)
+        self.substitutions.clear()
+        return data
+
+    def expect(self, regexes, timeout=None):
+        # Without output reader, nobody else consumes events: the next one must be the answer
+        text = self._recv(timeout, wait=False)
+        if text is None:
+            if self.pos >= len(self.events):
+                raise EOFError("Replay session ended")
+            return -1, None, b''
+        for i, r in enumerate(regexes):
+            m = r.search(text)
+            if m:
+                return i, m, text
+        return -1, None, text
+
+    def read_some(self):
+        data = self._recv(timeout=1)
+        if data is None:
+            if self.pos >= len(self.events):
+                return b''
+            import socket
+            raise socket.timeout()
+        return data
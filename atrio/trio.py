@@ -1,17 +1,57 @@
 import re
-import telnetlib
 import atexit
+import collections
+import threading
 import time
 import enum
-import random
-random.seed()
 from pathlib import Path
 
+from .tracing import span, traced
+
+# Heavy modules (telnetlib, crcmod, random) are imported where they are used
+# to keep the `atrio` command line startup fast.
+
 
 class AtrioError(Exception):
     pass
 
 
+class ConnectionLost(AtrioError):
+    """ The controller did not answer or the connection is closed """
+    pass
+
+
+default_timeout = 30  # seconds, for commands never seen before
+min_timeout = 2  # seconds, lower bound of learned timeouts
+timeout_factor = 10  # learned timeout is this times the max recent latency of the verb
+timeout_samples = 3  # latencies needed before using a learned timeout
+# Verbs whose latency grows with the size of the programs or varies widely (flash commits,
+# EtherCAT bus initialisation), they always use `default_timeout`
+payload_verbs = ('LIST', 'DIR', 'EDPROG', 'COMPILE', '&M', 'NEW', 'ETHERCAT(0', 'ETHERCAT(1')
+# Commands doing different things depending on their first argument, which is part of their verb
+function_code_verbs = ('ETHERCAT',)
+
+
+def command_verb(cmd):
+    """ What the latency of a command depends on: `?` for queries, `!R` for program line edits,
+    the command name and function code for `function_code_verbs` (like `ETHERCAT($22`),
+    otherwise the command name (like COMPILE or DEL).
+    """
+    cmd = cmd.lstrip()
+    if cmd.startswith('?'):
+        return '?'
+    m = re.match(r'^!\w+,\d*([A-Za-z])', cmd)
+    if m:
+        return '!' + m.group(1).upper()
+    m = re.match(r'^[&$]?\w*', cmd)
+    verb = m.group(0).upper()
+    if verb in function_code_verbs:
+        code = re.match(r'^\(\s*([$\w]+)', cmd[m.end():].lstrip())
+        if code:
+            verb += '(' + code.group(1).upper()
+    return verb
+
+
 program_types = {
     ".BAS": 0,  # Program type
     ".TXT": 3,  # Text type
@@ -75,6 +115,33 @@ def prettyprint_progtable(list_files, all=False):
         )
 
 
+system_load_limit = 50  # percent, maximum recommended system load according to trio help
+
+# One line of the `PROCESS` output per process, like:
+#   Process 2:Running - Program MAIN Line 12
+#   Process 21:Running - Command Line
+process_regex = re.compile(
+    r'^\s*Process\s+(?P<process>\d+)\s*:\s*(?P<status>\w+)\s*-\s*'
+    r'(?:Program\s+(?P<progname>\w+)\s+Line\s+(?P<line>\d+)|Command Line)\s*$')
+
+
+def parse_process_output(output):
+    """ Parse the output of the `PROCESS` command into {process number: record}.
+    Records have keys 'process', 'progname', 'status', 'line' and 'raw' (the original line),
+    progname and line are None for the command line process. Other lines are ignored.
+    """
+    processes = {}
+    for raw in output.splitlines():
+        m = process_regex.match(raw)
+        if not m:
+            continue
+        line = m.group('line')
+        processes[int(m.group('process'))] = {
+            'process': int(m.group('process')), 'progname': m.group('progname'), 'status': m.group('status'),
+            'line': None if line is None else int(line), 'raw': raw.rstrip()}
+    return processes
+
+
 def program_from_filename(filename, allow_progname=False):
     """ Returns the trio filename and associated prog_type """
     p = Path(filename)
@@ -108,28 +175,214 @@ class SystemError(enum.Flag):
 
 class EthercatState(enum.Enum):
     Initial = 0
-    PreOprational = 1
+    PreOperational = 1
+    PreOprational = 1  # Misspelled name kept for compatibility
     SafeOperational = 2
     Operational = 3
 
-import crcmod
-trioCRC16 = crcmod.Crc(0x18005, initCrc=0, rev=False, xorOut=0)
 
+# One line of the `ETHERCAT($87,<slot>)` output per slave:
+#   <position>: <address> 0x<vendor id> 0x<product code> 0x<revision> <name>
+# like ` 0: 1001 0x00000539 0x02200001 0x00000001 EK1100`
+ethercat_slave_regex = re.compile(
+    r'^\s*(?P<position>\d+):\s+(?P<address>\d+)\s+0x(?P<vendor>[0-9A-Fa-f]+)\s+0x(?P<product>[0-9A-Fa-f]+)'
+    r'\s+0x(?P<revision>[0-9A-Fa-f]+)(?:\s+(?P<name>.*?))?\s*$')
+
+
+def parse_ethercat_list(output):
+    """ Parse the output of `ETHERCAT($87,<slot>)` into a list of slave records ordered by position.
+    Records have keys 'position', 'address', 'vendor', 'product', 'revision', 'name' (None when empty)
+    and 'raw' (the original line). Other lines are ignored.
+    """
+    slaves = []
+    for raw in output.splitlines():
+        m = ethercat_slave_regex.match(raw)
+        if not m:
+            continue
+        slaves.append({
+            'position': int(m.group('position')), 'address': int(m.group('address')),
+            'vendor': int(m.group('vendor'), 16), 'product': int(m.group('product'), 16),
+            'revision': int(m.group('revision'), 16), 'name': m.group('name') or None, 'raw': raw.rstrip()})
+    return sorted(slaves, key=lambda r: r['position'])
+
+_trioCRC16 = None
+
+
+def trio_crc16():
+    """ Returns the crcmod template of the trio CRC16, created on first use """
+    global _trioCRC16
+    if _trioCRC16 is None:
+        import crcmod
+        _trioCRC16 = crcmod.Crc(0x18005, initCrc=0, rev=False, xorOut=0)
+    return _trioCRC16
+
+
+class _LazyCrc16:
+    """ Stands for the crcmod template of `trio_crc16`, crcmod is imported on first attribute access """
+    def __getattr__(self, name):
+        return getattr(trio_crc16(), name)
+
+
+trioCRC16 = _LazyCrc16()  # Kept for compatibility, prefer `trio_crc16()`
 
+
+@traced('crc')
 def crc_lines(lines):
     """ Expect a list of lines with no endings """
-    crc = trioCRC16.new()
+    crc = trio_crc16().new()
     for l in lines:
         crc.update(l.strip(b'\r\n'))
         crc.update(b'\xaa')
     return crc.crcValue
 
 
+@traced('crc')
 def crc_file(filename):
     with open(filename, 'rb') as f:
         return crc_lines(f.readlines())
 
 
+class OutputReader:
+    """ Background thread reading everything the controller sends on the telnet connection.
+
+    Bytes received while no command is waiting for its answer are unsolicited output
+    (typically programs printing to channel 0), they are split in lines and given to callback
+    or kept in the bounded `output` ring buffer (oldest lines are dropped).
+    Commands get their answers through `expect`, which mimics `telnetlib.Telnet.expect`.
+    Output printed by programs in the middle of a command answer cannot be told apart from it.
+    """
+    def __init__(self, telnet, maxlen=1000, callback=None):
+        self.telnet = telnet
+        self.output = collections.deque(maxlen=maxlen)
+        self.callback = callback
+        self.buffer = b''
+        self.pending = False  # True while a command waits for its answer
+        self.closed = False
+        self.stopped = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="atrio-reader", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        import socket
+        while not self.stopped:
+            try:
+                data = self.telnet.read_some()
+            except socket.timeout:
+                with self.cond:
+                    if not self.pending:
+                        self.flush(partial=True)
+                continue
+            except Exception:
+                data = b''
+            with self.cond:
+                if not data:
+                    self.closed = True
+                    self.cond.notify_all()
+                    return
+                self.buffer += data
+                if not self.pending:
+                    self.flush()
+                self.cond.notify_all()
+
+    def stop(self):
+        self.stopped = True
+        self.thread.join(timeout=2)
+
+    def flush(self, partial=False):
+        """ Move the complete lines of the buffer (or everything if partial) to the output """
+        end = len(self.buffer) if partial else self.buffer.rfind(b'\n') + 1
+        if end > 0:
+            self.add_output(self.buffer[:end])
+            self.buffer = self.buffer[end:]
+
+    def add_output(self, data):
+        text = data.decode(errors="ignore").replace('\r\n', '\n').replace('\r', '\n')
+        for line in text.splitlines():
+            if not line.strip() or line.strip() == '>>':
+                continue
+            if self.callback:
+                self.callback(line)
+            else:
+                self.output.append(line)
+
+    def begin(self):
+        """ To call before sending a command, what comes after is kept for `expect` """
+        with self.cond:
+            self.flush()
+            self.pending = True
+
+    def expect(self, regex, timeout):
+        """ Like `telnetlib.Telnet.expect` with a single regex: returns (0, match, text) or (-1, None, text) """
+        with self.cond:
+            m = None
+
+            def found():
+                nonlocal m
+                m = regex.search(self.buffer)
+                return m is not None or self.closed
+            self.cond.wait_for(found, timeout)
+            self.pending = False
+            if m:
+                text, self.buffer = self.buffer[:m.end()], self.buffer[m.end():]
+                self.flush()
+                return 0, m, text
+            text, self.buffer = self.buffer, b''
+            return -1, None, text
+
+    def pop_output(self):
+        """ Returns and forget the unsolicited output lines kept so far """
+        with self.cond:
+            lines = list(self.output)
+            self.output.clear()
+            return lines
+
+
+class AxisParams:
+    """ Values of axis parameters for several axes, as returned by `Trio.axis_params`.
+    values is a flat array of floats, row major: one row per axis, one column per parameter name.
+    """
+    def __init__(self, names, axes, values):
+        self.names = list(names)
+        self.axes = list(axes)
+        self.values = values
+
+    def get(self, axis, name):
+        return self.values[self.axes.index(axis) * len(self.names) + self.names.index(name.upper())]
+
+    def row(self, axis):
+        """ {name: value} of axis """
+        i = self.axes.index(axis) * len(self.names)
+        return dict(zip(self.names, self.values[i:i + len(self.names)]))
+
+    def column(self, name):
+        """ [value for each axis] of parameter name """
+        j = self.names.index(name.upper())
+        return list(self.values[j::len(self.names)])
+
+    def rows(self):
+        n = len(self.names)
+        return [list(self.values[i:i + n]) for i in range(0, len(self.values), n)]
+
+    def __repr__(self):
+        return "AxisParams(names={}, axes={}, values={})".format(self.names, self.axes, self.rows())
+
+
+max_command_length = 200  # characters, batched commands are split to stay below
+
+
+def _batches(items, prefix, sep):
+    """ Split item strings in command strings of at most `max_command_length` """
+    batch = []
+    for it in items:
+        if batch and len(prefix) + len(sep.join(batch + [it])) > max_command_length:
+            yield batch
+            batch = []
+        batch.append(it)
+    if batch:
+        yield batch
+
+
 class Trio:
     """
     Can be used simply as an object
@@ -137,50 +390,125 @@ class Trio:
     or can be used in a contextmanager (`with`)
     """
 
-    def connect(self, timeout=1, retry=3):
-        if self.t:
-            self.t.close()
-        else:
-            self.t = telnetlib.Telnet(timeout=timeout)
-        self.t.open(self.ip, timeout=timeout)
+    def make_transport(self, timeout):
+        """ The telnet connection, recording or replaying a session if asked (see `atrio.transport`) """
+        if self.replay:
+            from .transport import ReplayTelnet
+            return ReplayTelnet(self.replay, timing=self.replay_timing)
+        import telnetlib
+        t = telnetlib.Telnet(timeout=timeout)
+        if self.record:
+            from .transport import RecordingTelnet
+            t = RecordingTelnet(t, self.record, ip=self.ip)
+        return t
+
+    @traced('trio')
+    def connect(self, timeout=1, retry=3, deadline=None):
+        """ Open the connection and check the controller answers (timeout seconds per attempt).
+        deadline is a `time.monotonic()` time after which the connection attempts are given up.
+        """
+        import random
+
+        def attempt_timeout():
+            if deadline is None:
+                return timeout
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ConnectionLost("Could not connect to {} in time".format(self.name))
+            return min(timeout, remaining)
+        self.stop_heartbeat()
+        if not self.t:
+            self.t = self.make_transport(timeout)
+        self.reopen(attempt_timeout())
         for _ in range(retry + 1):
             try:
+                if self.dead:
+                    # No need to wait on a closed connection, open it again right away
+                    self.reopen(attempt_timeout())
                 x = str(int(1000000*random.random()))
-                output = self.commandS(f'?{x}', timeout=timeout)
+                output = self.commandS(f'?{x}', timeout=attempt_timeout())
                 if output != x:
                     print(re.sub('^', '    ', output, re.MULTILINE))
                 else:
                     break
-            except AtrioError:
+            except ConnectionLost:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+            except (AtrioError, OSError):
                 pass
         else:
             raise AtrioError("Could not connect: Motion Perfect probably open?")
 
-        if self.commandI("?MPE") != 0:
+        if self.commandI("?MPE", timeout=None if deadline is None else attempt_timeout()) != 0:
             raise AtrioError("Motion Perfect probably open (MPE != 0)")
+        if self.heartbeat_interval:
+            self.start_heartbeat(self.heartbeat_interval)
+
+    def reopen(self, timeout):
+        """ Close and open the connection again, with a new output reader if one was started """
+        self.t.close()
+        if self.reader:
+            self.reader.stop()
+        self.t.open(self.ip, timeout=timeout)
+        if self.reader:
+            self.reader = OutputReader(self.t, self.reader.output.maxlen, self.reader.callback)
+        self.dead = False
 
 
 
 
 
-    def __init__(self, ip, trace : bool=False):
+    def __init__(self, ip, trace : bool=False, auto_connect : bool=True,
+                 record : str=None, replay : str=None, replay_timing : bool=False):
+        """ record is a session file to save all the traffic to, replay a session file
+        to play back instead of connecting to ip (see `atrio.transport`).
+        """
         self.t = None
+        self.record = record
+        self.replay = replay
+        self.replay_timing = replay_timing
+        self.reader = None
+        self.dead = False
+        self.lock = threading.RLock()
+        self.latencies = {}  # verb -> recent latencies in seconds
+        self.last_command = time.monotonic()
+        self.heartbeat = None
+        self.heartbeat_interval = None
+        self._ethercat_slaves = None
         self.ip = ip
         self.name = ip
         self.trace = trace
         atexit.register(Trio.__del__, self)
-        self.connect(timeout=1)
+        if auto_connect:
+            self.connect(timeout=1)
 
     def __del__(self):
-        if 't' in self.__dict__:
+        if self.__dict__.get('heartbeat'):
+            self.heartbeat.set()
+        if self.__dict__.get('t'):
             self.t.close()
+            if self.record:
+                self.t.end()
 
     def __enter__(self):
         return self
 
+    def abort(self):
+        """ Shut the connection down, a command waiting for its answer (in another thread) fails at once """
+        import socket
+        try:
+            self.t.get_socket().shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+
     def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_heartbeat()
+        self.heartbeat_interval = None
         if self.t:
-            self.t.close()
+            with self.lock:
+                self.t.close()
+                if self.record:
+                    self.t.end()  # Complete the session file
         return False
 
     def decode(self, trio_str):
@@ -189,27 +517,124 @@ class Trio:
     def print_extra_output(self, bytes):
         print('    ', self.decode(bytes).replace('\n', '\n    '), sep='')
 
-    def command(self, cmd : str, timeout : float=30):
-        cmd = cmd.encode('ascii')
-        self.t.write(cmd + b'\r\n')
-        if self.trace:
-            print('-> ', cmd + b'\r\n')
+    def start_output_reader(self, maxlen=1000, callback=None):
+        """ Read the connection in a background thread so that output of running programs
+        (channel 0) is kept apart from command answers: given line by line to callback,
+        or kept in a ring buffer of maxlen lines, see `unsolicited_output`.
+        """
+        if self.reader:
+            self.reader.stop()
+        self.reader = OutputReader(self.t, maxlen, callback)
 
-        resp = b'(.*?)' + re.escape(cmd) + b'\r\n(.*)>>\nControl char : ((?-s:.*))\r\n>>'
+    def unsolicited_output(self):
+        """ Lines printed by programs since the last call (needs `start_output_reader`) """
+        return self.reader.pop_output() if self.reader else []
 
-        end_re = re.compile(resp, re.MULTILINE | re.DOTALL)
-        (_, r, answer) = self.t.expect([end_re], timeout)
+    def timeout_for(self, verb):
+        """ Timeout learned from the recent latencies of verb, `default_timeout` until enough are known
+        and for `payload_verbs`.
+        """
+        if verb.startswith(payload_verbs):
+            return default_timeout
+        latencies = self.latencies.get(verb)
+        if not latencies or len(latencies) < timeout_samples:
+            return default_timeout
+        return min(default_timeout, max(min_timeout, timeout_factor * max(latencies)))
+
+    def start_heartbeat(self, interval=5):
+        """ When idle for interval seconds, check the connection with a cheap query in the background,
+        so that a dead link is detected (and reported by the next command) without waiting for a timeout.
+        The heartbeat is restarted by `connect` and stopped when leaving the `with` block.
+        """
+        import weakref
+        self.stop_heartbeat()
+        self.heartbeat_interval = interval
+        stop = self.heartbeat = threading.Event()
+        ref = weakref.ref(self)  # Not to keep the Trio alive
+
+        def beat():
+            while not stop.wait(interval / 2):
+                trio = ref()
+                if trio is None:
+                    return
+                with trio.lock:
+                    if stop.is_set():
+                        return
+                    if not trio.dead and time.monotonic() - trio.last_command >= interval:
+                        try:
+                            trio.command("?0", timeout=trio.timeout_for('?'))
+                        except ConnectionLost:
+                            trio.dead = True
+                        except AtrioError:
+                            pass
+                del trio
+        threading.Thread(target=beat, name="atrio-heartbeat", daemon=True).start()
+
+    def stop_heartbeat(self):
+        if self.heartbeat:
+            self.heartbeat.set()
+            self.heartbeat = None
+
+    def command(self, cmd : str, timeout : float=None):
+        """ Execute cmd and return its output as bytes.
+        When timeout is None, it is learned from previous latencies of the same kind of command (`timeout_for`).
+        Raises ConnectionLost at once if the connection is known to be down (`connect` to restore it),
+        or when no answer came in time, unless only a learned timeout ran out (then a plain AtrioError).
+        """
+        verb = command_verb(cmd)
+        learned = False
+        if timeout is None:
+            timeout = self.timeout_for(verb)
+            learned = timeout < default_timeout
+        cmd = cmd.encode('ascii')
+        with self.lock:
+            if self.dead or (self.reader and self.reader.closed):
+                self.dead = True
+                raise ConnectionLost("Connection to {} is down (cmd: {})".format(self.name, repr(cmd)))
+            start = time.monotonic()
+            try:
+                with span(verb, 'wire', cmd=cmd.decode()):
+                    if self.reader:
+                        self.reader.begin()
+                    self.t.write(cmd + b'\r\n')
+                    if self.trace:
+                        print('-> ', cmd + b'\r\n')
+
+                    resp = b'(.*?)' + re.escape(cmd) + b'\r\n(.*)>>\nControl char : ((?-s:.*))\r\n>>'
+
+                    end_re = re.compile(resp, re.MULTILINE | re.DOTALL)
+                    if self.reader:
+                        (_, r, answer) = self.reader.expect(end_re, timeout)
+                    else:
+                        (_, r, answer) = self.t.expect([end_re], timeout)
+            except (EOFError, OSError) as e:
+                self.dead = True
+                raise ConnectionLost("Connection to {} lost (cmd: {}): {}".format(
+                    self.name, repr(cmd), e or type(e).__name__))
+            self.last_command = time.monotonic()
         if self.trace:
             print('<- ', answer)
+        if self.reader and self.reader.closed and not r:
+            self.dead = True
+            raise ConnectionLost("Connection to {} lost (cmd: {})".format(self.name, repr(cmd)))
         if not answer:
-            raise AtrioError("No response to {}".format(repr(cmd)))
+            if learned:
+                # Slower than usual is not a lost connection, start learning again from default_timeout
+                self.latencies.pop(verb, None)
+                raise AtrioError("No response to {} in {:.1f}s (learned timeout)".format(repr(cmd), timeout))
+            raise ConnectionLost("No response to {} in {:.1f}s".format(repr(cmd), timeout))
+        if r:
+            self.latencies.setdefault(verb, collections.deque(maxlen=20)).append(self.last_command - start)
         if not r:
             self.print_extra_output(answer)
             raise AtrioError("Cannot parse answer to {}: {}".format(repr(cmd), answer))
 
         # We have extra output before our command, let's display it
         if r.group(1):
-            self.print_extra_output(r.group(1))
+            if self.reader:
+                self.reader.add_output(r.group(1))
+            else:
+                self.print_extra_output(r.group(1))
 
         err = re.match(b'.*%(\[COMMAND[^\n]+)\r', r.group(2), re.MULTILINE | re.DOTALL)
         if err:
@@ -218,18 +643,20 @@ class Trio:
             raise AtrioError("Trio {} (cmd: {}) bad return code: {}".format(self.name, repr(cmd), r.group(3)))
         return re.sub(b'\r\n$', b'', r.group(2))  # Remove ending \r\n if answer is not empty
 
-    def commandI(self, cmd, timeout=30):
+    def commandI(self, cmd, timeout=None):
         return int(self.command(cmd, timeout))
 
-    def commandF(self, cmd, timeout=30):
+    def commandF(self, cmd, timeout=None):
         return float(self.command(cmd, timeout))
 
-    def commandS(self, cmd, timeout=30):
+    def commandS(self, cmd, timeout=None):
         """ Execute command and return the result as a string. """
         s = self.decode(self.command(cmd, timeout))
         return s
 
+    @traced('trio')
     def restart(self, wait=True):
+        self._ethercat_slaves = None
         try:
             self.command('EX', timeout=1)
         except AtrioError as e:
@@ -252,6 +679,7 @@ class Trio:
             print()
 
 
+    @traced('trio')
     def halt(self):
         try:
             self.command("HALT", timeout=0.5)
@@ -262,42 +690,76 @@ class Trio:
         """ Trio quoting is using \" and "" is quote of \" """
         return '"{}"'.format(s.replace('"', '""'))
 
+    @traced('trio')
     def read_program(self, progname):
         return self.commandS("LIST \"{}\"".format(progname))
 
-    def write_program(self, progname, prog_type=None, lines=None):
+    @traced('trio')
+    def write_program(self, progname, prog_type=None, lines=None, start_line=0, progress=None):
+        """ Write lines as program progname.
+        To resume an interrupted write, start_line is the number of lines already confirmed written,
+        it is only used if the checksum of the program in the controller matches these lines.
+        progress(n) is called once the line n-1 is confirmed written.
+        """
         if prog_type is None:
             prog_type = program_types['.BAS']
         if not lines:
             lines = ['']
+        if start_line:
+            lines = list(lines)
+            written = [l.strip("\n\r").encode('ascii') for l in lines[:start_line]]
+            try:
+                resumable = self.checksum_program(progname) == crc_lines(written)
+            except AtrioError:
+                resumable = False
+            if not resumable:
+                print(f"Cannot resume {progname} at line {start_line}, checksum differs, rewriting it")
+                start_line = 0
         try:
-            self.delete_program(progname)
+            if start_line:
+                print(f"Resuming {progname} at line {start_line}")
+            else:
+                self.delete_program(progname)
             self.command("SELECT {},{}".format(self.quote(progname), prog_type))
             for (n, l) in enumerate(lines):
+                if n < start_line:
+                    continue
                 self.command("!{},{}R{}".format(progname, n, l.strip("\n\r")))
+                if progress:
+                    progress(n + 1)
             self.command("!{},M".format(progname))
             # Try to commit things..
-            self.command("!{},Z".format(progname))
-            for _ in range(60):
-                if self.commandI("?FLASH_STATUS"):
-                    self.command("!{},Z".format(progname))
-                    time.sleep(0.03)
+            with span('flash_commit', 'trio', progname=progname):
+                self.command("!{},Z".format(progname))
+                for _ in range(60):
+                    if self.commandI("?FLASH_STATUS"):
+                        self.command("!{},Z".format(progname))
+                        time.sleep(0.03)
+                    else:
+                        break
                 else:
-                    break
-            else:
-                raise AtrioError("Flash Status never off, program might be corrupted")
+                    raise AtrioError("Flash Status never off, program might be corrupted")
 
             self.commandS("COMPILE", 60) # Compiling is needed to not have strange failures with communication to trio
         except Exception as e:
             e.args = ("Error writing {} program: {} ".format(progname, e.args[0]),) + e.args[1:]
             raise
 
+    @traced('trio')
+    def stop_program(self, progname):
+        """ Stop the processes running progname, the controller fails writing a running program """
+        progname = self.quote(progname)
+        if self.commandI("?IS_PROG {}".format(progname)):
+            self.command("STOP {}".format(progname))
+
+    @traced('trio')
     def delete_program(self, progname):
         progname = self.quote(progname)
         if self.commandI("?IS_PROG {}".format(progname)):
             self.command("DEL {}".format(progname))
             self.command("&M") # commit to flash
 
+    @traced('trio')
     def download_file(self, filename, with_file_extension=True):
         """ Download a file like TEST.BAS or MC_CONFIG.MCC from the controller.
         If the type of the file is unknown, it is possible to simply ask for TEST and set with_file_extension=False
@@ -318,11 +780,13 @@ class Trio:
         with open(filename, 'w', newline='\r\n') as f:
             f.write(self.read_program(progname) + '\n')
 
-    def upload_file(self, filename):
+    @traced('trio')
+    def upload_file(self, filename, start_line=0, progress=None):
         progname, prog_type = program_from_filename(filename)
         with open(filename, 'r') as f:
-            self.write_program(progname, prog_type, f)
+            self.write_program(progname, prog_type, f, start_line=start_line, progress=progress)
 
+    @traced('trio')
     def list_files(self):
         dirlist = self.commandS("DIR")
         progtable = re.match(".*---------\n(.*)OK", dirlist, re.MULTILINE | re.DOTALL).group(1)
@@ -344,13 +808,16 @@ class Trio:
             if f.is_file():
                 self.upload_file(str(f))
 
+    @traced('trio')
     def checksum_controller(self):
         print(self.commandS("COMPILE_ALL", 120))
         return self.commandI("?CHECKSUM")
 
+    @traced('trio')
     def checksum_program(self, progname):
         return self.commandI("EDPROG{},10".format(self.quote(progname)))
 
+    @traced('trio')
     def autorun_program(self, progname, process):
         """ Process -1 is automatic process selection, None removes the autorun"""
         prog = self.quote(progname)
@@ -361,6 +828,44 @@ class Trio:
             self.command("RUNTYPE{},{},{}".format(prog, 0, -1))
 
 
+    def axis_params(self, names, axes):
+        """ Read the axis parameters names (like MPOS, DPOS, FE, AXISSTATUS) of all axes
+        with a few batched print commands instead of one command per value.
+        :returns an `AxisParams`
+        """
+        import array
+        from .tokens import is_axis_parameter
+        names = [n.upper() for n in names]
+        for n in names:
+            if not is_axis_parameter(n):
+                raise AtrioError("{} is not an axis parameter".format(n))
+        items = ["{} AXIS({})".format(n, a) for a in axes for n in names]
+        values = array.array('d')
+        for batch in _batches(items, '?', ','):
+            output = self.commandS('?' + ','.join(batch))
+            numbers = re.findall(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?', output)
+            if len(numbers) != len(batch):
+                raise AtrioError("Expected {} values, got: {}".format(len(batch), output))
+            values.extend(float(x) for x in numbers)
+        return AxisParams(names, axes, values)
+
+    def set_axis_params(self, names, axes, values):
+        """ Write axis parameters, values has one row per axis with one value per name
+        (like `AxisParams.rows()`), statements are batched on command lines separated by `:`.
+        """
+        from .tokens import is_axis_parameter, is_writable_parameter
+        names = [n.upper() for n in names]
+        for n in names:
+            if not is_axis_parameter(n) or not is_writable_parameter(n):
+                raise AtrioError("{} is not a writable axis parameter".format(n))
+        values = list(values)
+        if len(values) != len(axes) or any(len(row) != len(names) for row in values):
+            raise AtrioError("Expected {} rows of {} values".format(len(axes), len(names)))
+        items = ["{} AXIS({})={}".format(n, a, repr(float(v)) if isinstance(v, float) else v)
+                 for (a, row) in zip(axes, values) for (n, v) in zip(names, row)]
+        for batch in _batches(items, '', ':'):
+            self.command(':'.join(batch))
+
     def system_error(self):
         return SystemError(self.commandI("?SYSTEM_ERROR"))
 
@@ -375,21 +880,73 @@ class Trio:
     def process_load(self):
         return self.commandS("PROCESS")
 
+    def processes(self):
+        """ Returns the running processes parsed from `PROCESS`, see `parse_process_output` """
+        return parse_process_output(self.process_load())
+
 
     def ethercat_list(self):
         return self.commandS("ETHERCAT($87,0)")
 
+    def ethercat_slaves(self, refresh=False):
+        """ Returns the parsed slave list (see `parse_ethercat_list`).
+        The list is cached until `ethercat_reinitialize` or refresh=True.
+        """
+        if self._ethercat_slaves is None or refresh:
+            self._ethercat_slaves = parse_ethercat_list(self.ethercat_list())
+        return self._ethercat_slaves
+
+    def ethercat_current_state(self):
+        return EthercatState(self.commandI("ETHERCAT($22,0,-1)"))
+
     def ethercat_state(self):
-        return EthercatState(self.commandI("ETHERCAT($22,0,-1)")).name
+        return self.ethercat_current_state().name
 
     def ethercat_set_state(self, state : EthercatState):
         return self.commandS(f"ETHERCAT($21, 0, {state.value}, 0) ")
 
+    def ethercat_wait_for_state(self, state : EthercatState, timeout : float=30, max_poll : float=0.5):
+        """ Wait for the EtherCAT bus to reach state.
+        Polling starts fast and backs off up to max_poll seconds, it speeds up again on each state change.
+        :returns the list of observed transitions as (from_state, to_state, seconds spent in from_state)
+        """
+        start = time.monotonic()
+        current = self.ethercat_current_state()
+        since = start
+        poll = 0.01
+        transitions = []
+        while current != state:
+            now = time.monotonic()
+            if now - start > timeout:
+                raise AtrioError("EtherCAT did not reach {} in {}s (still {})".format(
+                    state.name, timeout, current.name))
+            time.sleep(min(poll, max(0, timeout - (now - start))))
+            observed = self.ethercat_current_state()
+            if observed != current:
+                now = time.monotonic()
+                transitions.append((current, observed, now - since))
+                current, since, poll = observed, now, 0.01
+            else:
+                poll = min(poll * 1.5, max_poll)
+        return transitions
+
     def ethercat_reinitialize(self):
+        self._ethercat_slaves = None
         return self.commandS("ETHERCAT(0, 0)")
 
-    def ethercat_start(self):
-        return self.ethercat_state(EthercatState.Operational)
+    def ethercat_start(self, timeout : float=30):
+        """ Bring the bus to Operational.
+        :returns the list of transitions, see `ethercat_wait_for_state`
+        """
+        self.ethercat_set_state(EthercatState.Operational)
+        return self.ethercat_wait_for_state(EthercatState.Operational, timeout)
 
     def ethercat_stop(self):
         return self.commandS("ETHERCAT(1, 0)")
+
+
+def format_transitions(transitions):
+    """ Human readable transitions as returned by `Trio.ethercat_wait_for_state` """
+    lines = ["{} -> {}: {:.3f}s".format(a.name, b.name, d) for (a, b, d) in transitions]
+    lines.append("Total: {:.3f}s".format(sum(d for (_, _, d) in transitions)))
+    return '\n'.join(lines)
@@ -2,13 +2,21 @@
 # PYTHON_ARGCOMPLETE_OK
 
 import atrio
+from atrio import completion
 
 import argparse
-import argcomplete
+import os
+import sys
 
 
 def construct_trio(args):
-    return atrio.Trio(args.ip, args.trace)
+    if args.replay and not args.ip:
+        from atrio.transport import session_ip
+        args.ip = session_ip(args.replay)
+    t = atrio.Trio(args.ip, args.trace, record=args.record, replay=args.replay, replay_timing=args.replay_timing)
+    if args.heartbeat:
+        t.start_heartbeat(args.heartbeat)
+    return t
 
 
 def construct_workspace(args):
@@ -25,16 +33,41 @@ def controller_cmd(args):
 
 def controller_ls(args):
     t = construct_trio(args)
-    return atrio.prettyprint_progtable(t.list_files(), args.lsall)
+    list_files = t.list_files()
+    completion.write_cache(args.ip, list_files)
+    return atrio.prettyprint_progtable(list_files, args.lsall)
 
 def controller_top(args):
     t = construct_trio(args)
-    print(t.process_load())
+    if not args.live:
+        print(t.process_load())
+        return
+    from atrio.top import Top
+    spikes = Top(t, interval=args.interval, logfile=args.log).run(count=args.count)
+    return 1 if spikes else 0
 
 def controller_ethercat(args):
     t = construct_trio(args)
     print(getattr(t, 'ethercat_' + args.subfunc)())
 
+
+def controller_ethercat_start(args):
+    t = construct_trio(args)
+    print(atrio.format_transitions(t.ethercat_start(timeout=args.timeout)))
+
+
+def controller_ethercat_wait(args):
+    t = construct_trio(args)
+    s = atrio.EthercatState[args.state]
+    print(atrio.format_transitions(t.ethercat_wait_for_state(s, timeout=args.timeout)))
+
+
+def controller_ethercat_slaves(args):
+    t = construct_trio(args)
+    for s in t.ethercat_slaves():
+        print("{:>3} {:>6} 0x{:08X} 0x{:08X} 0x{:08X}  {}".format(
+            s['position'], s['address'], s['vendor'], s['product'], s['revision'], s['name'] or ''))
+
 def controller_ethercat_set(args):
     t = construct_trio(args)
     s = atrio.EthercatState[args.state]
@@ -43,6 +76,15 @@ def controller_ethercat_set(args):
 
 
 
+def controller_axes(args):
+    t = construct_trio(args)
+    axes = range(args.axes)
+    p = t.axis_params(args.params.split(','), axes)
+    print("{:>4} ".format("AXIS") + " ".join("{:>14}".format(n) for n in p.names))
+    for a, row in zip(axes, p.rows()):
+        print("{:>4} ".format(a) + " ".join("{:>14.4f}".format(v) for v in row))
+
+
 def controller_show(args):
     t = construct_trio(args)
     print(t.read_program(atrio.program_from_filename(args.progname, allow_progname=True)[0]))
@@ -67,29 +109,96 @@ def ws_check(args):
     ws = construct_workspace(args)
     ws.load(args.wsfile)
     diff = ws.controller_diff()
+    if args.timing:
+        ws.print_timings()
     return ws.summarize_diff(diff, print_summary=True, ignore_extras=args.no_extra, print_diff=not args.no_diff)
 
 
 def ws_upload(args):
     ws = construct_workspace(args)
     ws.load(args.wsfile)
+    if args.no_halt:
+        ws.trio.start_output_reader(callback=lambda line: print('    [ch0]', line))
     for i in range(args.retry + 1):
         if i:
-            print(f"Retrying({i}) to upload")
+            print(f"Retrying({i}) to upload, reconnecting")
+            try:
+                ws.trio.connect()
+            except Exception as e:
+                print(e)
+                continue
         try:
-            rst_needed = ws.write_to_controller(clear=args.clear, auto_restart=not args.no_auto_restart)
-            return 10 if rst_needed else 0
+            rst_needed = ws.write_to_controller(clear=args.clear, auto_restart=not args.no_auto_restart,
+                                                halt=not args.no_halt)
+            if args.timing:
+                ws.print_timings()
+            return 10 if rst_needed == 10 else 0
         except Exception as e:
             print(e)
             pass
 
 
+def ws_plan(args):
+    ws = construct_workspace(args)
+    ws.load(args.wsfile)
+    diff = ws.controller_diff()
+    ws.print_plan(ws.plan_deploy(diff, remove_extra=True))
+
+
 def ws_download(args):
     ws = construct_workspace(args)
     return ws.update_from_controller(args.wsfile, interactive=True)
 
 
 
+def archive_add(args):
+    from atrio.archive import Archive
+    a = Archive(args.archive)
+    manifest, new = a.add_controller(construct_trio(args), args.name)
+    refs, stored = a.stats()
+    print(f"Archived {len(manifest['files'])} programs of {manifest['name']} ({new} new), "
+          f"archive has {refs} programs stored in {stored} bodies")
+
+
+def archive_ls(args):
+    from atrio.archive import Archive
+    a = Archive(args.archive)
+    if args.name:
+        for f in a.manifest(args.name)['files']:
+            print("{}{}".format(f['filename'], " ({})".format(f['autorun']) if f['autorun'] else ""))
+    else:
+        for c in a.controllers():
+            print(c)
+
+
+def archive_show(args):
+    from atrio.archive import Archive
+    print(Archive(args.archive).read_program(args.name, args.filename), end='')
+
+
+def archive_restore(args):
+    from atrio.archive import Archive
+    restart_reasons = Archive(args.archive).restore_controller(construct_trio(args), args.name, clear=args.clear)
+    if restart_reasons:
+        print("Restart needed for " + ", ".join(restart_reasons))
+        return 10
+
+
+def fleet_status(args):
+    from atrio import fleet
+    if args.drives_file:
+        controllers = fleet.load_drives_file(args.drives_file)
+    elif args.ip:
+        controllers = [{'name': ip, 'ip': ip, 'ws': None} for ip in args.ip.split(',')]
+    else:
+        print("Controllers are needed, from --drives_file or --ip")
+        return 2
+    for c in controllers:
+        c['ws'] = c['ws'] or args.ws
+    result = fleet.fleet_status(controllers, jobs=args.jobs, timeout=args.timeout)
+    return 1 if fleet.print_fleet_status(controllers, result) else 0
+
+
 def main():
 
     parser = argparse.ArgumentParser(description="Trio controller management tool")
@@ -98,12 +207,24 @@ def main():
     parser.add_argument('--ip', type=str, help="Controller IP/hostname")
 
     parser.add_argument('--trace', action='store_true', help="Enable tracing of all interaction with the controller.")
+    parser.add_argument('--heartbeat', type=float, metavar='SECONDS',
+                        help="Check the connection when idle for that long, to detect a dead link early")
+    parser.add_argument('--profile', type=str, metavar='TRACE_FILE',
+                        help="Record a timeline of the operations (workspace, files, trio methods, commands) "
+                        "in Chrome trace event format (open with chrome://tracing or ui.perfetto.dev)")
+    parser.add_argument('--cprofile', type=str, metavar='PROF_FILE', help="Dump cProfile statistics to this file")
+    parser.add_argument('--record', type=str, metavar='SESSION_FILE',
+                        help="Record everything sent to and received from the controller with timestamps")
+    parser.add_argument('--replay', type=str, metavar='SESSION_FILE',
+                        help="Replay a recorded session instead of connecting to the controller")
+    parser.add_argument('--replay-timing', action='store_true', help="Replay with the recorded delays")
     parser.add_argument('--folder', help="Folder in which to create files, default same as wsfile")
 
     subparsers = parser.add_subparsers()
 
     cmd_parser = subparsers.add_parser('cmd', help="Execute a trio command like ?version or 'ethercat(0,0)'")
-    cmd_parser.add_argument('command', type=str, nargs='+', help="Command to give to the drive")
+    cmd_parser.add_argument('command', type=str, nargs='+', help="Command to give to the drive"
+                            ).completer = completion.keyword_completer
     cmd_parser.set_defaults(func=controller_cmd)
 
     ls_parser = subparsers.add_parser('ls', help="List files in the controller")
@@ -112,19 +233,42 @@ def main():
 
     top_parser = subparsers.add_parser('top', help="List process and cpu usage in the controller")
     top_parser.set_defaults(func=controller_top)
+    top_parser.add_argument('--live', '-l', action='store_true',
+                            help="Continuously display parsed processes and system load, "
+                            "return 1 if the system load went above 50%%")
+    top_parser.add_argument('--interval', '-i', type=float, default=1.0, help="Refresh interval in seconds (live mode)")
+    top_parser.add_argument('--count', '-n', type=int, help="Stop after n refreshes (live mode)")
+    top_parser.add_argument('--log', type=str, help="Append each sample as a json line to this file (live mode)")
 
     ethercat_parser = subparsers.add_parser('ethercat', help="trio ethercat commands")
     ethercat_subparsers = ethercat_parser.add_subparsers()
-    for f in ["list", "state", "reinitialize", "start", "stop"]:
+    for f in ["list", "state", "reinitialize", "stop"]:
         sp = ethercat_subparsers.add_parser(f)
         sp.set_defaults(subfunc=f)
         sp.set_defaults(func=controller_ethercat)
+    ethercat_slaves_parser = ethercat_subparsers.add_parser("slaves", help='Parsed list of the slaves')
+    ethercat_slaves_parser.set_defaults(func=controller_ethercat_slaves)
+    ethercat_start_parser = ethercat_subparsers.add_parser("start", help='Bring the bus to Operational and '
+                                                           'report the time of each transition')
+    ethercat_start_parser.add_argument('--timeout', type=float, default=30, help="Timeout in seconds")
+    ethercat_start_parser.set_defaults(func=controller_ethercat_start)
+    ethercat_wait_parser = ethercat_subparsers.add_parser("wait", help='Wait for the bus to reach a state')
+    ethercat_wait_parser.add_argument("state", choices=[str(s.name) for s in atrio.EthercatState])
+    ethercat_wait_parser.add_argument('--timeout', type=float, default=30, help="Timeout in seconds")
+    ethercat_wait_parser.set_defaults(func=controller_ethercat_wait)
     ethercat_set_parser = ethercat_subparsers.add_parser("set_state", help='Change ethercat status')
     ethercat_set_parser.add_argument("state", choices=[str(s.name) for s in atrio.EthercatState])
     ethercat_set_parser.set_defaults(func=controller_ethercat_set)
 
+    axes_parser = subparsers.add_parser('axes', help="Display axis parameters of all axes (few round trips)")
+    axes_parser.add_argument('--params', '-p', type=str, default="MPOS,DPOS,FE,AXISSTATUS",
+                             help="Comma separated axis parameters")
+    axes_parser.add_argument('--axes', '-n', type=int, default=16, help="Number of axes")
+    axes_parser.set_defaults(func=controller_axes)
+
     show_parser = subparsers.add_parser('show', help="Display a file from the controller")
-    show_parser.add_argument('progname', type=str, help="Programe name to show")
+    show_parser.add_argument('progname', type=str, help="Programe name to show"
+                             ).completer = completion.program_completer
     show_parser.set_defaults(func=controller_show)
 
     restart_parser = subparsers.add_parser('restart', help="Restart the controller (special call to EX)")
@@ -138,6 +282,7 @@ def main():
 
     ws_parser = subparsers.add_parser('ws', help="Workspace management subcommands")
     ws_parser.add_argument('wsfile', type=str, help="Workspace yaml file")
+    ws_parser.add_argument('--timing', action='store_true', help="Print the time spent per stage (check and upload)")
 
     ws_sub_parsers = ws_parser.add_subparsers()
 
@@ -157,24 +302,91 @@ def main():
     ws_upload_parser.add_argument('--no-auto-restart', action="store_true",
                                   help="Prevent auto restarting when it is considered needed, \n"
                                   "note that return value will be 10 if restart was considered needed")
+    ws_upload_parser.add_argument('--no-halt', action="store_true",
+                                  help="Keep programs running (unless MC_CONFIG changes), only the programs "
+                                  "rewritten or deleted are stopped. Their output is "
+                                  "read in background and printed prefixed with [ch0]")
     ws_upload_parser.add_argument('--retry', type=int, default=0,
                                   help="Retry x number of times in case of failure")
 
     ws_upload_parser.set_defaults(func=ws_upload)
 
+    ws_plan_parser = ws_sub_parsers.add_parser('plan', help="Print the steps and estimated time an upload would take")
+    ws_plan_parser.set_defaults(func=ws_plan)
+
     ws_download_parser = ws_sub_parsers.add_parser('download', help="Download changes from the controller")
     ws_download_parser.set_defaults(func=ws_download)
 
 
-    argcomplete.autocomplete(parser)
+    # `archive` subcommand
+
+    archive_parser = subparsers.add_parser('archive', help="Fleet backup archive storing identical programs once")
+    archive_parser.add_argument('archive', type=str, help="Archive file")
+
+    archive_sub_parsers = archive_parser.add_subparsers()
+
+    archive_add_parser = archive_sub_parsers.add_parser('add', help="Add (or replace) the programs of the controller")
+    archive_add_parser.add_argument('--name', type=str, help="Name of the controller in the archive, default is ip")
+    archive_add_parser.set_defaults(func=archive_add)
+
+    archive_ls_parser = archive_sub_parsers.add_parser('ls', help="List controllers, or programs of one controller")
+    archive_ls_parser.add_argument('name', type=str, nargs='?', help="Controller name")
+    archive_ls_parser.set_defaults(func=archive_ls)
+
+    archive_show_parser = archive_sub_parsers.add_parser('show', help="Display a program of a controller")
+    archive_show_parser.add_argument('name', type=str, help="Controller name")
+    archive_show_parser.add_argument('filename', type=str, help="Program file name like MAIN.BAS")
+    archive_show_parser.set_defaults(func=archive_show)
+
+    archive_restore_parser = archive_sub_parsers.add_parser('restore', help="Write the programs of a controller "
+                                                            "from the archive to the controller, returns 10 if a restart is needed")
+    archive_restore_parser.add_argument('name', type=str, help="Controller name in the archive")
+    archive_restore_parser.add_argument('--clear', action="store_true",
+                                        help="Start from scratch removing everything in the controller first")
+    archive_restore_parser.set_defaults(func=archive_restore)
+
+    # `fleet` subcommand
+
+    fleet_parser = subparsers.add_parser('fleet', help="Commands on all the controllers of --drives_file "
+                                         "(or a comma separated --ip list)")
+    fleet_sub_parsers = fleet_parser.add_subparsers()
+
+    fleet_status_parser = fleet_sub_parsers.add_parser('status', help="Read only scan of all controllers in "
+                                                       "parallel, printing their drift from their workspace")
+    fleet_status_parser.add_argument('--ws', type=str, help="Reference workspace for controllers without 'ws' field")
+    fleet_status_parser.add_argument('--jobs', '-j', type=int, default=32, help="Number of controllers scanned at once")
+    fleet_status_parser.add_argument('--timeout', type=float, default=20, help="Timeout per controller in seconds")
+    fleet_status_parser.set_defaults(func=fleet_status)
+
+    if '_ARGCOMPLETE' in os.environ:
+        # Only pay for argcomplete when the shell is actually completing
+        import argcomplete
+        argcomplete.autocomplete(parser)
 
     args = parser.parse_args()
-    if 'func' in args.__dict__:
-        return args.func(args)
-    else:
+    if 'func' not in args.__dict__:
         return parser.print_usage()
+    if not args.profile and not args.cprofile:
+        return args.func(args)
+
+    from atrio import tracing
+    if args.profile:
+        tracing.enable()
+    if args.cprofile:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+    try:
+        with tracing.span(' '.join(sys.argv[1:]), 'cli'):
+            return args.func(args)
+    finally:
+        if args.cprofile:
+            cprofiler.disable()
+            cprofiler.dump_stats(args.cprofile)
+        if args.profile:
+            tracing.disable().save(args.profile)
+            print(f"Trace saved to {args.profile}", file=sys.stderr)
 
 
 if __name__ == "__main__":
-    import sys
     sys.exit(main())
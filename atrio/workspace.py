@@ -1,7 +1,32 @@
 
-import yaml
+import locale
+import os
+import time
 
 from .trio import *
+from .tracing import span, traced
+
+
+# Rough durations in seconds used to estimate a deploy plan
+deploy_estimates = {
+    'delete': 0.2,
+    'upload': 1.0,  # Commit to flash and compilation
+    'line': 0.01,  # Per line of an uploaded program
+    'autorun': 0.05,
+    'restart': 30,
+}
+
+
+@traced('file')
+def prepare_file(filename):
+    """ Read a program file once for both checking and uploading it:
+    returns {'filename', 'lines' (bytes without line endings), 'crc' (trio CRC), 'stat' (mtime, size)}
+    """
+    st = os.stat(filename)
+    with open(filename, 'rb') as f:
+        lines = [l.rstrip(b'\r\n') for l in f.readlines()]
+    return {'filename': filename, 'lines': lines, 'crc': crc_lines(lines),
+            'stat': (st.st_mtime_ns, st.st_size)}
 
 
 class Workspace:
@@ -16,21 +41,79 @@ class Workspace:
         self.trio = trio
         self.ws = None
         self.wsfiledir = Path()
+        self.checkpoint = None
+        self.jobs = 4  # Threads preparing files ahead of the controller
+        self.prepared = {}  # filename -> prepare_file() result
+        self.timings = {}
 
+    @traced('workspace')
     def save(self, wsfile):
+        import yaml
         with open(wsfile, 'w') as f:
-            yaml.dump(self.ws, f)
+            yaml.dump(self.ws, f, Dumper=getattr(yaml, 'CDumper', yaml.Dumper))
 
+    @traced('workspace')
     def load(self, wsfile):
+        import yaml
+        self.checkpoint = None
+        self.prepared = {}
         with open(wsfile) as f:
-            self.ws = yaml.load(f, Loader=yaml.Loader)
+            # The C loader (when libyaml is available) is much faster for big workspaces
+            self.ws = yaml.load(f, Loader=getattr(yaml, 'CLoader', yaml.Loader))
             self.wsfiledir = Path(wsfile).parent
 
+    def prepared_file(self, filename):
+        """ `prepare_file` result of filename, reused while the file is unchanged """
+        p = self.prepared.get(filename)
+        st = os.stat(filename)
+        if p is None or p['stat'] != (st.st_mtime_ns, st.st_size):
+            p = prepare_file(filename)
+        return p
+
+    def prepare_files(self, filenames):
+        """ Start reading and checksumming filenames in a pool of self.jobs threads, so that the caller
+        can talk to the controller in the meantime. Returns a future per file, to give to `wait_prepared`.
+        """
+        def prepare(filename):
+            start = time.perf_counter()
+            p = self.prepared_file(filename)
+            return p, time.perf_counter() - start
+
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=self.jobs)
+        futures = [pool.submit(prepare, f) for f in filenames]
+        pool.shutdown(wait=False)  # Submitted files are still prepared
+        return futures
+
+    def wait_prepared(self, future):
+        """ `prepare_file` result of a future of `prepare_files`, kept in self.prepared and reused
+        while the file is unchanged. Time spent preparing and waiting for it is added to self.timings.
+        """
+        start = time.perf_counter()
+        p, duration = future.result()
+        self.timings['wait'] = self.timings.get('wait', 0) + time.perf_counter() - start
+        self.timings['prepare'] = self.timings.get('prepare', 0) + duration
+        self.prepared[p['filename']] = p
+        return p
+
+    def print_timings(self):
+        """ Time per stage of the last controller_diff and write_to_controller """
+        t = self.timings
+        if 'diff' in t:
+            controller = t['diff'] - t.get('wait', 0)
+            print("Timings: diff {:.3f}s: controller {:.3f}s, file preparation {:.3f}s in {} threads "
+                  "(waited for it {:.3f}s, overlapped {:.3f}s)".format(
+                      t['diff'], controller, t.get('prepare', 0), self.jobs, t.get('wait', 0),
+                      max(0, controller + t.get('prepare', 0) - t['diff'])))
+        if 'upload' in t:
+            print("Timings: upload {:.3f}s".format(t['upload']))
+
     def entry_from_list_file(self, folder, ll):
         """ Workspace entry from a file listing entry from trio.list_files() """
         filename = folder + '/' + ll['progname'] + extension_from_code_type(ll['codetype'])
         return {'filename': filename, 'autorun': ll['autorun']}
 
+    @traced('workspace')
     def load_controller(self, folder='.'):
         """ Create a workspace to match the controller one """
         files = []
@@ -40,6 +123,7 @@ class Workspace:
             'files': files
         }
 
+    @traced('workspace')
     def new_from_controller(self, wsfile, folder=None):
         """ Create a workspace from the controller content.
         Save the workspace file as wsfile, and the programs in folder.
@@ -62,6 +146,7 @@ class Workspace:
 
         self.save(wsfile)
 
+    @traced('workspace')
     def update_from_controller(self, wsfile, interactive=False):
         """ Update the programs of the workspace """
         if interactive:
@@ -116,34 +201,33 @@ class Workspace:
         self.save(wsfile)
 
 
-    def write_to_controller(self, remove_extra=True, clear=False, auto_restart=True):
-        """ Write the current workspace to the controller.
-        If clear, it will clear everything in the controller before uploading.
-        If remove_extra, it will remove extra files in the controller.
-        :returns 0 if nothing changed, 1 if changed, 10 if a restart is considered needed
+    @traced('workspace')
+    def upload_file(self, filename, start_line=0, progress=None):
+        """ Like `Trio.upload_file`, using the prepared content of the file (see `prepare_files`) """
+        prep = self.prepared[filename] = self.prepared_file(filename)
+        progname, prog_type = program_from_filename(filename)
+        encoding = locale.getpreferredencoding(False)  # As the text files read by `Trio.upload_file`
+        lines = [l.decode(encoding) for l in prep['lines']]
+        self.trio.write_program(progname, prog_type, lines, start_line=start_line, progress=progress)
+
+    @traced('workspace')
+    def plan_deploy(self, cdiff, remove_extra=True):
+        """ Compute the steps to write the workspace to the controller from a `controller_diff`.
+        Steps are dicts with an 'action' ('delete', 'upload', 'autorun' or 'restart')
+        and an 'estimate' in seconds (see `deploy_estimates`).
+        MC_CONFIG is uploaded first, and all changes needing a restart are merged in one final restart.
+        Removing an autorun does not need a restart.
         """
-        self.trio.halt()  # Trio will fail when there are running progs and we write some
-        if clear:
-            self.trio.commandS('NEW "ALL"')
-            #for f in self.trio.list_files():
-            #    self.trio.delete_program(f)
-
-        cdiff = self.controller_diff()
-
-        changed = self.summarize_diff(cdiff, print_summary=True,
-                                      ignore_extras=not remove_extra, print_diff=True)
-
-        if not changed:
-            return 0
+        steps = []
+        restart_reasons = []
 
         if remove_extra:
-            for p in cdiff['extra_progs']:
-                self.trio.delete_program(p)
-
-        restart_needed = False
+            for p in sorted(cdiff['extra_progs']):
+                steps.append({'action': 'delete', 'progname': p, 'estimate': deploy_estimates['delete']})
 
         to_upload = cdiff['missing'] + cdiff['wrong_type'] + cdiff['different']
-
+        uploads = []
+        autoruns = []
         for f in self.ws.get('files', []):
             filename = self.wsfiledir / f['filename']
             progname, prog_type = program_from_filename(filename)
@@ -151,21 +235,124 @@ class Workspace:
             update_autorun = False
 
             if filename in to_upload:
-                print(f"Updating {filename}")
-                self.trio.upload_file(filename)
+                if filename in self.prepared:
+                    nlines = len(self.prepared[filename]['lines'])
+                else:
+                    with open(filename, 'rb') as fl:
+                        nlines = len(fl.readlines())
+                uploads.append({'action': 'upload', 'filename': filename, 'prog_type': prog_type,
+                                'estimate': deploy_estimates['upload'] + nlines * deploy_estimates['line']})
                 if prog_type == program_types['.MCC']:
-                    print(f"Restart needed after change of MC_CONFIG.MCC")
-                    restart_needed = True
+                    restart_reasons.append(f"change of {filename}")
                 elif prog_type == program_types['.BAS']:
                     update_autorun = True
 
             if update_autorun or filename in cdiff["autorun_changed"]:
                 if prog_type != 0:
                     raise AtrioError(f"Cannot set autorun on non BAS program {progname}")
-                self.trio.autorun_program(progname, autorun)
-                if autorun:
-                    print(f"Restart needed to autorun {filename}")
-                    restart_needed = True
+                autoruns.append({'action': 'autorun', 'filename': filename, 'progname': progname,
+                                 'autorun': autorun, 'estimate': deploy_estimates['autorun']})
+                if autorun is not None:
+                    restart_reasons.append(f"autorun of {filename}")
+
+        # MC_CONFIG first, it configures what the other programs use
+        uploads.sort(key=lambda s: s['prog_type'] != program_types['.MCC'])
+        steps += uploads + autoruns
+
+        if restart_reasons:
+            steps.append({'action': 'restart', 'reasons': restart_reasons, 'estimate': deploy_estimates['restart']})
+        return steps
+
+    def print_plan(self, plan):
+        print("Deploy plan:")
+        for s in plan:
+            if s['action'] == 'delete':
+                what = s['progname']
+            elif s['action'] == 'restart':
+                what = "for " + ", ".join(s['reasons'])
+            elif s['action'] == 'autorun':
+                what = "{} -> {}".format(s['filename'], s['autorun'])
+            else:
+                what = str(s['filename'])
+            print("    {:>6.1f}s  {:<8} {}".format(s['estimate'], s['action'], what))
+        print("    {:>6.1f}s  total".format(sum(s['estimate'] for s in plan)))
+
+    @traced('workspace')
+    def write_to_controller(self, remove_extra=True, clear=False, auto_restart=True, halt=True):
+        """ Write the current workspace to the controller, following `plan_deploy`.
+        If clear, it will clear everything in the controller before uploading.
+        If remove_extra, it will remove extra files in the controller.
+        If not halt, programs are left running unless MC_CONFIG needs to be written, only the programs
+        deleted or rewritten are stopped first
+        (better with `Trio.start_output_reader` so their output does not disturb commands).
+        Progress is recorded in self.checkpoint, if the connection is lost (`ConnectionLost`), calling it again
+        (after reconnecting) resumes from the last confirmed step and line instead of starting over.
+        Other errors drop the checkpoint.
+        :returns 0 if nothing changed, 1 if changed, 10 if a restart is considered needed
+        """
+        if halt:
+            self.trio.halt()  # Trio will fail when there are running progs and we write some
+
+        cp = self.checkpoint
+        if cp is None:
+            if clear:
+                self.trio.commandS('NEW "ALL"')
+                #for f in self.trio.list_files():
+                #    self.trio.delete_program(f)
+
+            cdiff = self.controller_diff()
+
+            changed = self.summarize_diff(cdiff, print_summary=True,
+                                          ignore_extras=not remove_extra, print_diff=True)
+
+            if not changed:
+                return 0
+
+            plan = self.plan_deploy(cdiff, remove_extra)
+            self.print_plan(plan)
+            cp = self.checkpoint = {'plan': plan, 'step': 0, 'lines': 0}
+        else:
+            print(f"Resuming upload at step {cp['step'] + 1}/{len(cp['plan'])}")
+
+        plan = cp['plan']
+
+        if not halt and any(s['action'] == 'upload' and s['prog_type'] == program_types['.MCC'] for s in plan):
+            print("MC_CONFIG needs to be written, halting programs")
+            self.trio.halt()
+
+        def progress(n):
+            cp['lines'] = n
+
+        restart_needed = False
+        start = time.perf_counter()
+        try:
+            while cp['step'] < len(plan):
+                s = plan[cp['step']]
+                with span("{} {}".format(s['action'], s.get('filename', s.get('progname', ''))), 'file'):
+                    if s['action'] == 'delete':
+                        if not halt:
+                            self.trio.stop_program(s['progname'])
+                        self.trio.delete_program(s['progname'])
+                    elif s['action'] == 'upload':
+                        print(f"Updating {s['filename']}")
+                        if not halt:
+                            self.trio.stop_program(program_from_filename(s['filename'])[0])
+                        self.upload_file(s['filename'], start_line=cp['lines'], progress=progress)
+                    elif s['action'] == 'autorun':
+                        self.trio.autorun_program(s['progname'], s['autorun'])
+                    elif s['action'] == 'restart':
+                        print("Restart needed for " + ", ".join(s['reasons']))
+                        restart_needed = True
+                cp['step'] += 1
+                cp['lines'] = 0
+        except ConnectionLost:
+            raise  # Keep the checkpoint to resume once reconnected
+        except Exception:
+            self.checkpoint = None  # Not a link failure, next call starts from a new diff
+            raise
+
+        self.checkpoint = None
+        self.timings['upload'] = time.perf_counter() - start
 
         if restart_needed and auto_restart:
             self.trio.restart()
@@ -173,10 +360,12 @@ class Workspace:
         return 10 if restart_needed else 1
 
 
-    def check_controller_filecontent(self, filename):
+    def check_controller_filecontent(self, filename, fcrc=None):
         """ Check that a file is the same as in the controller (using checksum).
+        fcrc is the checksum of the file when already known.
         """
-        fcrc = crc_file(filename)
+        if fcrc is None:
+            fcrc = crc_file(filename)
         progname, prog_type = program_from_filename(filename)
         try:
             ccrc = self.trio.checksum_program(progname)
@@ -184,10 +373,19 @@ class Workspace:
         except Exception:
             return False
 
+    @traced('workspace')
     def controller_diff(self):
+        """ Compare the workspace to the controller.
+        Files are prepared (read and checksummed) by `prepare_files` while the controller is queried.
+        """
         if self.ws is None:
             raise AtrioError("Workspace is empty, please load a workspace.")
 
+        start = time.perf_counter()
+        self.timings = {}
+        files = [(f, self.wsfiledir / f['filename']) for f in self.ws.get('files', [])]
+        prepared = self.prepare_files([filename for (_, filename) in files])
+
         cfiles = self.trio.list_files()
         extras = set(cfiles.keys())
         missing = []
@@ -195,26 +393,33 @@ class Workspace:
         different = []
         autorun_changed = []
 
-        for f in self.ws.get('files', []):
-            filename = self.wsfiledir / f['filename']
-            progname, prog_type = program_from_filename(filename)
-            if progname not in cfiles:
-                missing.append(filename)
-            else:
-                extras.remove(progname)
-                ll = cfiles[progname]
-                cprog_type = program_types.get(extension_from_code_type(ll['codetype']))
-                if prog_type != cprog_type:
-                    wrong_type.append(filename)
-                if not self.check_controller_filecontent(filename):
-                    different.append(filename)
-                if str(ll['autorun']) != str(f.get('autorun', None)):
-                    autorun_changed.append(filename)
+        try:
+            for ((f, filename), fut) in zip(files, prepared):
+                prep = self.wait_prepared(fut)
+                progname, prog_type = program_from_filename(filename)
+                if progname not in cfiles:
+                    missing.append(filename)
+                    continue
+                with span(str(filename), 'file'):
+                    extras.remove(progname)
+                    ll = cfiles[progname]
+                    cprog_type = program_types.get(extension_from_code_type(ll['codetype']))
+                    if prog_type != cprog_type:
+                        wrong_type.append(filename)
+                    if not self.check_controller_filecontent(filename, prep['crc']):
+                        different.append(filename)
+                    if str(ll['autorun']) != str(f.get('autorun', None)):
+                        autorun_changed.append(filename)
+        finally:
+            for fut in prepared:
+                fut.cancel()
+        self.timings['diff'] = time.perf_counter() - start
 
         return {'missing': missing, 'wrong_type': wrong_type, 'different': different,
                 'autorun_changed': autorun_changed, 'extra_progs': extras}
 
 
+    @traced('workspace')
     def summarize_diff(self, cdiff, ignore_extras=False, print_summary=False, print_diff=False):
         changed = False
 
@@ -267,6 +472,7 @@ class Workspace:
 
 
 
+    @traced('workspace')
     def download_all(self):
         for f in self.ws.get('files', []):
             self.trio.download_file(self.wsfiledir / f['filename'])
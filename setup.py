@@ -13,6 +13,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/AbundantRobotics/atrio",
     packages=setuptools.find_packages(),
+    package_data={'atrio': ['tokentable']},
     install_requires=[
         "argparse~=1.4",
         "argcomplete~=1.11",
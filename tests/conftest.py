@@ -71,3 +71,19 @@ def trio_tmp_prog(trio, request):
 
 
 
+
+
+from fakes import FakeTelnet, FakeTrio
+
+
+@pytest.fixture
+def fake_trio():
+    return FakeTrio()
+
+
+@pytest.fixture
+def telnet_trio():
+    """ Trio talking to a `FakeTelnet`, not connected yet """
+    t = atrio.Trio('fake', auto_connect=False)
+    t.t = FakeTelnet()
+    return t
@@ -0,0 +1,146 @@
+""" In memory fakes of a controller, for the tests not needing hardware """
+
+import queue
+import re
+import socket
+import time
+
+import atrio
+
+
+class FakeTrio(atrio.Trio):
+    """ In memory emulation of the program storage of a controller, at the `command` level.
+    `fail_at` is a list of command numbers at which to simulate a dropped connection.
+    EtherCAT states and system loads are answered from the scripted lists `ethercat_states`
+    and `system_loads` (the last value is kept).
+    """
+    def __init__(self):
+        super().__init__('fake', auto_connect=False)
+        self.programs = {}  # progname -> {'type': prog_type, 'lines': [bytes], 'autorun': None/process}
+        self.selected = None
+        self.commands = []
+        self.fail_at = []
+        self.ethercat_states = [3]
+        self.system_loads = [0.0]
+
+    @staticmethod
+    def scripted(values):
+        return values.pop(0) if len(values) > 1 else values[0]
+
+    def connect(self, timeout=1, retry=3):
+        self.selected = None
+
+    def dir_output(self):
+        codetypes = {v: k for (k, v) in atrio.code_types.items()}
+        lines = []
+        for name, p in sorted(self.programs.items()):
+            autorun = "None" if p['autorun'] is None else "Auto({})".format(p['autorun'])
+            codetype = codetypes[atrio.extension_from_prog_type(p['type'])]
+            lines.append("{} {} 0 {} {}".format(name, len(p['lines']), autorun, codetype))
+        return "Directory\n---------\n" + "\n".join(lines + ["OK"])
+
+    def command(self, cmd, timeout=30):
+        self.commands.append(cmd)
+        if len(self.commands) in self.fail_at:
+            raise atrio.ConnectionLost("No response to {}".format(repr(cmd)))
+        m = re.match(r'^(?:\?IS_PROG|DEL|\?PROG_TYPE|LIST|EDPROG|SELECT|RUNTYPE) ?"((?:[^"]|"")*)",?(.*)$', cmd)
+        name = m.group(1) if m else None
+        args = m.group(2).split(',') if m else []
+        if cmd.startswith('?IS_PROG'):
+            return b'1' if name in self.programs else b'0'
+        if cmd.startswith('?PROG_TYPE'):
+            return str(self.programs[name]['type'] if name in self.programs else -1).encode()
+        if cmd.startswith('DEL'):
+            del self.programs[name]
+        elif cmd.startswith('SELECT'):
+            self.programs.setdefault(name, {'type': int(args[0]), 'lines': [], 'autorun': None})
+            self.selected = name
+        elif cmd.startswith('LIST'):
+            return b'\r\n'.join(self.programs[name]['lines'])
+        elif cmd.startswith('EDPROG'):
+            if name not in self.programs:
+                raise atrio.AtrioError("Command Error")
+            return str(atrio.crc_lines(self.programs[name]['lines'])).encode()
+        elif cmd.startswith('RUNTYPE'):
+            self.programs[name]['autorun'] = int(args[1]) if args[0] == '1' else None
+        elif cmd == 'DIR':
+            return self.dir_output().encode()
+        elif cmd in ('?FLASH_STATUS', '?MPE', '?SYSTEM_ERROR'):
+            return b'0'
+        elif cmd == '?VERSION':
+            return b'2.0305'
+        elif cmd == 'ETHERCAT($22,0,-1)':
+            return str(self.scripted(self.ethercat_states)).encode()
+        elif cmd == 'ETHERCAT($87,0)':
+            return b" 0: 1001 0x00000539 0x02200001 0x00000001 EK1100"
+        elif cmd == '?SYSTEM_LOAD_MAX':
+            return str(self.scripted(self.system_loads)).encode()
+        elif cmd == 'PROCESS':
+            return "Process 2:Running - Program MAIN Line {}".format(len(self.commands)).encode()
+        elif cmd == '?CHECKSUM':
+            return str(sum(atrio.crc_lines(p['lines']) for p in self.programs.values()) % 65536).encode()
+        elif cmd.startswith('!'):
+            m = re.match(r'^!(\w+),(\d+)R(.*)$', cmd, re.DOTALL)
+            if m:
+                assert m.group(1) == self.selected
+                lines = self.programs[self.selected]['lines']
+                n = int(m.group(2))
+                lines[n:n + 1] = [m.group(3).encode('ascii')]
+        return b''
+
+
+class FakeTelnet:
+    """ Telnet answering queries `?<n>` with n, `?MPE` with 0, through `expect` or `read_some` (for `OutputReader`).
+    Programs output can be injected with `program_print`. Once `alive` is False it behaves as a closed socket,
+    the next fail_writes writes fail as on a dropped connection. When not answering, commands time out.
+    """
+    def __init__(self):
+        self.alive = True
+        self.answering = True
+        self.opened = 0
+        self.fail_writes = 0
+        self.timeouts = []
+        self.written = []
+        self.q = queue.Queue()
+
+    def open(self, host, timeout=None):
+        self.opened += 1
+        self.alive = True
+
+    def close(self):
+        self.q.put(None)
+
+    def program_print(self, text):
+        self.q.put(text.encode())
+
+    def write(self, data):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            self.alive = False
+        if not self.alive:
+            raise BrokenPipeError(32, "Broken pipe")
+        self.written.append(data)
+        if self.answering:
+            answer = b'0' if data == b'?MPE\r\n' else data[1:-2]
+            self.q.put(data + answer + b'\r\n>>\nControl char : 0x10000000A\r\n>>')
+
+    def expect(self, regexes, timeout=None):
+        self.timeouts.append(timeout)
+        if not self.alive:
+            raise EOFError("telnet connection closed")
+        if not self.answering:
+            time.sleep(timeout)
+            return -1, None, b''
+        text = None
+        while text is None:
+            text = self.q.get_nowait()
+        return 0, regexes[0].search(text), text
+
+    def read_some(self):
+        if not self.alive:
+            return b''
+        try:
+            data = self.q.get(timeout=0.05)
+        except queue.Empty:
+            raise socket.timeout()
+        return b'' if data is None else data
@@ -0,0 +1,53 @@
+from fakes import FakeTrio
+
+from atrio.archive import Archive
+
+
+def controller(name, programs):
+    t = FakeTrio()
+    t.ip = t.name = name
+    for progname, lines in programs.items():
+        t.programs[progname] = {'type': 0, 'lines': [l.encode() for l in lines], 'autorun': None}
+    return t
+
+
+common = {'MAIN': ['PRINT "main"', 'STOP'], 'LIB': ['x = 1']}
+
+
+def test_archive_deduplicates(tmp_path):
+    a = Archive(str(tmp_path / 'fleet.zip'))
+    _, new = a.add_controller(controller('cell1', common))
+    assert new == 2
+    cell2 = controller('cell2', dict(common, EXTRA=['y = 2']))
+    cell2.programs['MAIN']['autorun'] = 3
+    _, new = a.add_controller(cell2)
+    assert new == 1
+    assert a.controllers() == ['cell1', 'cell2']
+    assert a.stats() == (5, 3)
+    files = {f['filename']: f for f in a.manifest('cell2')['files']}
+    assert files['MAIN.BAS']['autorun'] == '3'
+    assert a.read_program('cell1', 'main.bas') == 'PRINT "main"\nSTOP\n'
+
+    # Replacing a controller drops the bodies it was the only one to use
+    a.add_controller(controller('cell2', common))
+    assert a.stats() == (4, 2)
+
+
+def test_archive_restore(tmp_path, monkeypatch):
+    a = Archive(str(tmp_path / 'fleet.zip'))
+    cell = controller('cell1', common)
+    cell.programs['MAIN']['autorun'] = 3
+    cell.programs['MC_CONFIG'] = {'type': 9, 'lines': [b'AXIS(0)'], 'autorun': None}
+    a.add_controller(cell)
+    new = controller('new', {})
+    opened = []
+    zip_ = a._zip
+    monkeypatch.setattr(a, '_zip', lambda *args: opened.append(args) or zip_(*args))
+    reasons = a.restore_controller(new, 'cell1')
+    assert new.programs == cell.programs
+    assert len(opened) == 1
+    # Programs halted, then MC_CONFIG written first
+    assert new.commands[0] == 'HALT'
+    selects = [c for c in new.commands if c.startswith('SELECT')]
+    assert selects[0].startswith('SELECT "MC_CONFIG"')
+    assert reasons == ['change of MC_CONFIG.MCC', 'autorun of MAIN.BAS']
@@ -0,0 +1,53 @@
+import re
+
+import pytest
+
+import atrio
+
+
+class AxesTrio(atrio.Trio):
+    """ Controller where parameter n of axis a is a * 100 + n """
+    names = ['MPOS', 'DPOS', 'FE', 'AXISSTATUS', 'SPEED']
+
+    def __init__(self):
+        super().__init__('fake', auto_connect=False)
+        self.commands = []
+        self.written = {}
+
+    def command(self, cmd, timeout=None):
+        self.commands.append(cmd)
+        if cmd.startswith('?'):
+            values = [a * 100 + self.names.index(n) for (n, a) in re.findall(r'(\w+) AXIS\((\d+)\)', cmd)
+                      for a in [int(a)]]
+            return '\t'.join("{:.4f}".format(v) for v in values).encode()
+        for statement in cmd.split(':'):
+            m = re.match(r'^(\w+) AXIS\((\d+)\)=(.*)$', statement)
+            self.written[(m.group(1), int(m.group(2)))] = float(m.group(3))
+        return b''
+
+
+def test_axis_params_batched():
+    t = AxesTrio()
+    p = t.axis_params(['mpos', 'DPOS', 'FE', 'AXISSTATUS'], range(16))
+    assert len(t.commands) < 16 * 4 / 4  # a handful of commands
+    assert all(len(c) <= atrio.max_command_length for c in t.commands)
+    assert p.get(3, 'FE') == 302
+    assert p.row(15) == {'MPOS': 1500, 'DPOS': 1501, 'FE': 1502, 'AXISSTATUS': 1503}
+    assert p.column('DPOS') == [a * 100 + 1 for a in range(16)]
+    assert len(p.values) == 64
+
+
+def test_axis_params_checks_names():
+    t = AxesTrio()
+    with pytest.raises(atrio.AtrioError):
+        t.axis_params(['VERSION'], [0])
+    with pytest.raises(atrio.AtrioError):
+        t.set_axis_params(['MPOS'], [0], [[1]])  # MPOS is read only
+
+
+def test_set_axis_params():
+    t = AxesTrio()
+    t.set_axis_params(['SPEED', 'UNITS'], range(10), [[a, 0.5] for a in range(10)])
+    assert len(t.commands) < 10
+    assert t.written[('SPEED', 7)] == 7
+    assert t.written[('UNITS', 9)] == 0.5
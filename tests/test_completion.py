@@ -0,0 +1,55 @@
+import argparse
+import time
+
+import pytest
+
+from atrio import completion
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    refreshes = []
+    monkeypatch.setattr(completion, 'refresh_in_background', refreshes.append)
+    return refreshes
+
+
+list_files = {
+    'MAIN': {'progname': 'MAIN', 'codetype': 'Normal', 'autorun': '10'},
+    'MC_CONFIG': {'progname': 'MC_CONFIG', 'codetype': 'MC_CONFIG', 'autorun': None},
+    'PROJ': {'progname': 'PROJ', 'codetype': 'Project', 'autorun': None},
+}
+
+
+def test_program_completer(cache):
+    args = argparse.Namespace(ip='192.168.0.100')
+    completion.write_cache(args.ip, list_files)
+    assert completion.program_completer('', args) == ['MAIN.BAS', 'MC_CONFIG.MCC']
+    assert completion.program_completer('mc', args) == ['mc_config.mcc']
+    assert cache == []  # cache is fresh
+
+
+def test_stale_cache_is_refreshed_in_background(cache, monkeypatch):
+    args = argparse.Namespace(ip='192.168.0.100')
+    assert completion.program_completer('', args) == []
+    assert cache == ['192.168.0.100']
+
+    completion.write_cache(args.ip, list_files)
+    monkeypatch.setattr(completion, 'CACHE_TTL', -1)
+    assert completion.program_completer('MA', args) == ['MAIN.BAS']
+    assert cache == ['192.168.0.100'] * 2
+
+
+def test_keyword_completer():
+    assert 'MPOS' in completion.keyword_completer('MP')
+    assert '?mpos' in completion.keyword_completer('?mp')
+    assert 'EOX' not in completion.keyword_completer('EO')  # syntax tokens are not keywords
+
+
+def test_completion_is_fast(cache):
+    args = argparse.Namespace(ip='192.168.0.100')
+    completion.write_cache(args.ip, list_files)
+    start = time.perf_counter()
+    completion.program_completer('', args)
+    completion.keyword_completer('')
+    assert time.perf_counter() - start < 0.05
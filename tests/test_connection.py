@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+import atrio
+
+
+def test_command_verb():
+    assert atrio.command_verb("?VR(10)") == '?'
+    assert atrio.command_verb("!MAIN,12RPRINT 1") == '!R'
+    assert atrio.command_verb("!MAIN,Z") == '!Z'
+    assert atrio.command_verb('DEL "MAIN"') == 'DEL'
+    assert atrio.command_verb("COMPILE") == 'COMPILE'
+    assert atrio.command_verb("ETHERCAT($22,0,-1)") == 'ETHERCAT($22'
+    assert atrio.command_verb("ETHERCAT(0, 0)") == 'ETHERCAT(0'
+
+
+def test_learned_timeouts(telnet_trio):
+    t = telnet_trio
+    assert t.timeout_for('?') == atrio.default_timeout
+    for i in range(atrio.timeout_samples):
+        assert t.commandI("?{}".format(i)) == i
+    assert t.t.timeouts == [atrio.default_timeout] * atrio.timeout_samples
+    assert t.timeout_for('?') == atrio.min_timeout
+    t.commandI("?5")
+    assert t.t.timeouts[-1] == atrio.min_timeout
+    # Other verbs are not affected, explicit timeouts are kept
+    assert t.timeout_for('COMPILE') == atrio.default_timeout
+    # Commands whose answer grows with the programs keep the default timeout
+    for i in range(atrio.timeout_samples):
+        t.command('LIST "P{}"'.format(i))
+    assert t.timeout_for('LIST') == atrio.default_timeout
+    for verb in ['&M', 'NEW', 'ETHERCAT(0']:
+        assert t.timeout_for(verb) == atrio.default_timeout
+    t.command("?6", timeout=60)
+    assert t.t.timeouts[-1] == 60
+
+
+def test_dead_link_fails_fast_and_reconnects(telnet_trio):
+    t = telnet_trio
+    t.t.alive = False
+    with pytest.raises(atrio.ConnectionLost):
+        t.command("?1")
+    assert t.dead
+    written = len(t.t.written)
+    with pytest.raises(atrio.ConnectionLost):
+        t.command("?1")
+    assert len(t.t.written) == written  # Nothing sent on a dead connection
+
+    t.connect()
+    assert not t.dead
+    assert t.commandI("?7") == 7
+
+
+def test_heartbeat_detects_dead_link(telnet_trio):
+    t = telnet_trio
+    t.start_heartbeat(interval=0.05)
+    t.t.alive = False
+    for _ in range(50):
+        if t.dead:
+            break
+        time.sleep(0.02)
+    t.heartbeat.set()
+    assert t.dead
+
+
+def test_heartbeat_ignores_parse_errors_and_stops_on_exit(telnet_trio, monkeypatch):
+    t = telnet_trio
+    answers = []
+
+    def command(cmd, timeout=None):
+        answers.append(cmd)
+        raise atrio.AtrioError("Cannot parse answer")
+    monkeypatch.setattr(t, 'command', command)
+    with t:
+        t.start_heartbeat(interval=0.02)
+        heartbeat = t.heartbeat
+        for _ in range(50):
+            if answers:
+                break
+            time.sleep(0.02)
+        assert answers
+        assert not t.dead
+    assert heartbeat.is_set() and t.heartbeat is None
+    n = len(answers)
+    time.sleep(0.1)
+    assert len(answers) == n
+
+
+def test_reconnect_with_output_reader(telnet_trio):
+    t = telnet_trio
+    t.start_output_reader()
+    t.t.fail_writes = 1  # First handshake command of connect fails
+    t.connect()
+    assert t.t.opened == 2
+    assert t.commandI("?7") == 7
+    t.t.program_print("running\r\n")
+    assert t.commandI("?8") == 8
+    assert t.unsolicited_output() == ["running"]
+    t.reader.stop()
+
+
+def test_learned_timeout_is_not_a_lost_connection(telnet_trio, monkeypatch):
+    monkeypatch.setattr(atrio.trio, 'min_timeout', 0.05)
+    t = telnet_trio
+    for i in range(atrio.timeout_samples):
+        t.commandI("?{}".format(i))
+    t.t.answering = False
+    with pytest.raises(atrio.AtrioError, match="learned timeout") as e:
+        t.command("?5")
+    assert not isinstance(e.value, atrio.ConnectionLost)
+    assert not t.dead
+    assert t.timeout_for('?') == atrio.default_timeout  # Learning again
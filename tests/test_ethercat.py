@@ -0,0 +1,53 @@
+import pytest
+
+import atrio
+from atrio import EthercatState
+
+
+# ETHERCAT($87,0) output of a bus with a coupler and a drive
+ETHERCAT_SAMPLE = (
+    "3 slaves found\r\n"
+    " 1: 1002 0x0000009A 0x00030924 0x00010420 Gold Drive\r\n"
+    " 0: 1001 0x00000539 0x02200001 0x00000001 EK1100\r\n"
+    " 2: 1003 0x00000002 0x03F03052 0x00100000\r\n"
+)
+
+
+def test_parse_ethercat_list():
+    slaves = atrio.parse_ethercat_list(ETHERCAT_SAMPLE)
+    assert [s['position'] for s in slaves] == [0, 1, 2]
+    assert slaves[0]['address'] == 1001
+    assert slaves[0]['vendor'] == 0x539 and slaves[0]['revision'] == 1
+    assert slaves[0]['name'] == 'EK1100'
+    assert slaves[1]['product'] == 0x30924
+    assert slaves[1]['name'] == 'Gold Drive'
+    assert slaves[2]['name'] is None
+
+
+def test_ethercat_start_reports_transitions(fake_trio):
+    t = fake_trio
+    t.ethercat_states = [0, 0, 1, 1, 2, 3]
+    transitions = t.ethercat_start()
+    assert t.commands[0].startswith("ETHERCAT($21, 0, 3, 0)")
+    assert [(a, b) for (a, b, _) in transitions] == [
+        (EthercatState.Initial, EthercatState.PreOperational),
+        (EthercatState.PreOperational, EthercatState.SafeOperational),
+        (EthercatState.SafeOperational, EthercatState.Operational)]
+    assert "Total" in atrio.format_transitions(transitions)
+
+
+def test_ethercat_wait_timeout(fake_trio):
+    t = fake_trio
+    t.ethercat_states = [1]
+    with pytest.raises(atrio.AtrioError):
+        t.ethercat_wait_for_state(EthercatState.Operational, timeout=0.05)
+
+
+def test_ethercat_slaves_cached_until_reinitialize(fake_trio):
+    t = fake_trio
+    assert t.ethercat_slaves()[0]['name'] == 'EK1100'
+    t.ethercat_slaves()
+    assert t.commands.count("ETHERCAT($87,0)") == 1
+    t.ethercat_reinitialize()
+    t.ethercat_slaves()
+    assert t.commands.count("ETHERCAT($87,0)") == 2
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import yaml
+from fakes import FakeTelnet, FakeTrio
+
+from atrio import fleet
+
+
+class HangingTrio(FakeTrio):
+    """ Controller not answering until aborted """
+    def __init__(self):
+        super().__init__()
+        self.aborted = threading.Event()
+
+    def command(self, cmd, timeout=30):
+        self.aborted.wait(5)
+        raise EOFError("telnet connection closed")
+
+    def abort(self):
+        self.aborted.set()
+
+
+def test_fleet_status(tmp_path):
+    with open(tmp_path / 'MAIN.BAS', 'w') as f:
+        f.write("x = 1\n")
+    with open(tmp_path / 'ws.yaml', 'w') as f:
+        yaml.dump({'files': [{'filename': 'MAIN.BAS', 'autorun': None}]}, f)
+    with open(tmp_path / 'drives.yaml', 'w') as f:
+        yaml.dump({'ok': {'ip': '10.0.0.1', 'ws': 'ws.yaml'},
+                   'drift': {'ip': '10.0.0.2', 'ws': 'ws.yaml'},
+                   'dead': {'ip': '10.0.0.3'}}, f)
+    controllers = fleet.load_drives_file(str(tmp_path / 'drives.yaml'))
+
+    def connect(ip, deadline):
+        if ip == '10.0.0.3':
+            return HangingTrio()
+        t = FakeTrio()
+        t.programs['MAIN'] = {'type': 0, 'lines': [b'x = 1'], 'autorun': None}
+        if ip == '10.0.0.2':
+            t.programs['MAIN']['lines'] = [b'x = 2']
+            t.programs['EXTRA'] = {'type': 0, 'lines': [], 'autorun': None}
+        return t
+
+    start = time.monotonic()
+    result = fleet.fleet_status(controllers, timeout=0.5, connect=connect)
+    assert time.monotonic() - start < 2
+    assert result['ok']['drift'] == []
+    assert result['ok']['ethercat'] == 'Operational'
+    assert result['drift']['drift'] == ['different: MAIN.BAS', 'extra: EXTRA']
+    assert 'timeout' in result['dead']['error']
+    assert fleet.print_fleet_status(controllers, result) == 2
+
+
+def test_fleet_timeout_bounds_connection():
+    def connect(ip, deadline):
+        t = fleet.Trio(ip, auto_connect=False)
+        t.t = FakeTelnet()
+        t.t.answering = False
+        t.connect(deadline=deadline)
+        return t
+
+    start = time.monotonic()
+    result = fleet.fleet_status([{'name': 'slow', 'ip': '10.0.0.4', 'ws': None}], timeout=0.3, connect=connect)
+    assert time.monotonic() - start < 0.6
+    assert 'timeout' in result['slow']['error']
@@ -0,0 +1,52 @@
+"""
+Import time benchmark of the `atrio` command line.
+
+The command line is called very often from scripts, and for tab completion,
+so its cold start must stay fast. Heavy modules are only to be imported by the
+subcommands needing them. To look at the details:
+
+    python -X importtime -c "import atrio.trio_cmd"
+
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+# `-X importtime` exists since python 3.7
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason="needs python -X importtime (3.7+)")
+
+# Target for the cumulative import time of `atrio.trio_cmd` (`atrio cmd` cold start)
+COLD_START_TARGET_US = 100000
+
+HEAVY_MODULES = ['yaml', 'crcmod', 'telnetlib', 'argcomplete', 'random']
+
+
+def importtime(module):
+    """ Returns {module: cumulative import time in us} of a fresh interpreter importing module """
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                       stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('module', ['atrio', 'atrio.trio_cmd'])
+def test_no_heavy_imports(module):
+    times = importtime(module)
+    assert module in times
+    for m in HEAVY_MODULES:
+        assert m not in times, "{} should not be imported by {}".format(m, module)
+
+
+def test_cold_start_target():
+    # Best of a few runs to not be too sensitive to a busy machine
+    best = min(importtime('atrio.trio_cmd')['atrio.trio_cmd'] for _ in range(3))
+    print("atrio.trio_cmd import: {} us (target {} us)".format(best, COLD_START_TARGET_US))
+    assert best < COLD_START_TARGET_US
@@ -0,0 +1,26 @@
+def test_unsolicited_output_is_kept_apart(telnet_trio):
+    t = telnet_trio
+    t.start_output_reader(maxlen=2)
+    telnet = t.t
+    telnet.program_print("running 1\r\nrunning 2\r\nrunning 3\r\n")
+    assert t.commandI("?42") == 42
+    telnet.program_print("running 4\r\n")
+    assert t.commandI("?42") == 42
+    # Ring buffer keeps the 2 latest lines
+    assert t.unsolicited_output() == ["running 3", "running 4"]
+    assert t.unsolicited_output() == []
+    telnet.close()
+    t.reader.stop()
+
+
+def test_unsolicited_output_callback(telnet_trio):
+    lines = []
+    t = telnet_trio
+    t.start_output_reader(callback=lines.append)
+    telnet = t.t
+    telnet.program_print("partial ")
+    telnet.program_print("line\r\n")
+    assert t.commandI("?42") == 42
+    assert lines == ["partial line"]
+    telnet.close()
+    t.reader.stop()
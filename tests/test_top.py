@@ -0,0 +1,39 @@
+import io
+import json
+
+import atrio
+from atrio.top import Top
+
+
+# PROCESS output of a controller running MAIN and HOMING
+PROCESS_SAMPLE = (
+    "Process 2:Running - Program MAIN Line 12\r\n"
+    "Process 3:Paused - Program HOMING Line 40\r\n"
+    "Process 21:Running - Command Line\r\n"
+)
+
+
+def test_parse_process_output():
+    ps = atrio.parse_process_output(PROCESS_SAMPLE)
+    assert sorted(ps) == [2, 3, 21]
+    assert ps[2]['progname'] == 'MAIN' and ps[2]['status'] == 'Running' and ps[2]['line'] == 12
+    assert ps[3]['progname'] == 'HOMING' and ps[3]['status'] == 'Paused' and ps[3]['line'] == 40
+    assert ps[21]['progname'] is None and ps[21]['line'] is None
+    assert ps[21]['raw'] == "Process 21:Running - Command Line"
+
+
+def test_top_redraws_changed_rows(tmp_path, fake_trio):
+    class Tty(io.StringIO):
+        def isatty(self):
+            return True
+
+    out = Tty()
+    log = tmp_path / 'top.log'
+    fake_trio.system_loads = [10.0, 60.0, 60.0]
+    top = Top(fake_trio, interval=0, logfile=str(log), out=out)
+    assert top.run(count=3) == 2
+    assert top.peak_load == 60.0
+    # Second row (the header) is drawn once
+    assert out.getvalue().count("PROGRAM") == 1
+    samples = [json.loads(l) for l in log.read_text().splitlines()]
+    assert [s['system_load'] for s in samples] == [10.0, 60.0, 60.0]
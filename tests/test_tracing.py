@@ -0,0 +1,52 @@
+import json
+
+import yaml
+
+import atrio
+from atrio import tracing
+
+
+def test_trace_upload(tmp_path, fake_trio):
+    with open(tmp_path / 'MAIN.BAS', 'w') as f:
+        f.write("x = 1\n")
+    with open(tmp_path / 'ws.yaml', 'w') as f:
+        yaml.dump({'files': [{'filename': 'MAIN.BAS', 'autorun': None}]}, f)
+
+    tracing.enable()
+    try:
+        trio = fake_trio
+        trio.programs['MAIN'] = {'type': 0, 'lines': [b'x = 2'], 'autorun': None}
+        ws = atrio.Workspace(trio)
+        ws.load(str(tmp_path / 'ws.yaml'))
+        ws.write_to_controller()
+    finally:
+        profiler = tracing.disable()
+    profiler.save(str(tmp_path / 'trace.json'))
+
+    with open(tmp_path / 'trace.json') as f:
+        events = json.load(f)['traceEvents']
+    assert {e['cat'] for e in events} >= {'workspace', 'file', 'trio', 'crc'}
+    names = [e['name'] for e in events]
+    assert 'Workspace.write_to_controller' in names
+    assert 'Trio.write_program' in names
+    assert 'Workspace.plan_deploy' in names and 'Workspace.upload_file' in names
+    # Spans are nested: the upload is inside write_to_controller
+    outer = next(e for e in events if e['name'] == 'Workspace.write_to_controller')
+    inner = next(e for e in events if e['name'] == 'Trio.write_program')
+    assert outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+
+def test_spans_disabled():
+    assert tracing._profiler is None
+    with tracing.span('nothing', 'test'):
+        pass
+
+
+def test_connect_traced(telnet_trio):
+    tracing.enable()
+    try:
+        telnet_trio.connect()
+    finally:
+        profiler = tracing.disable()
+    names = [e['name'] for e in profiler.events]
+    assert 'Trio.connect' in names
@@ -0,0 +1,54 @@
+import pytest
+from fakes import FakeTelnet
+
+import atrio
+
+
+class RecordedTrio(atrio.Trio):
+    """ Trio recording its session over a FakeTelnet instead of a real connection """
+    def make_transport(self, timeout):
+        from atrio.transport import RecordingTelnet
+        return RecordingTelnet(FakeTelnet(), self.record, ip=self.ip)
+
+
+def test_record_replay(tmp_path):
+    session = str(tmp_path / 'session.jsonl')
+    with RecordedTrio('10.0.0.1', record=session) as t:
+        assert t.commandI("?42") == 42
+        assert t.commandS("?VERSION") == "VERSION"
+
+    from atrio.transport import session_ip
+    assert session_ip(session) == '10.0.0.1'
+    r = atrio.Trio('10.0.0.1', replay=session)  # connection handshake uses another random number
+    assert r.commandI("?42") == 42
+    assert r.commandS("?VERSION") == "VERSION"
+    with pytest.raises(atrio.ConnectionLost):
+        r.command("?1")  # Nothing more recorded
+
+
+def test_replay_diverges(tmp_path):
+    session = str(tmp_path / 'session.jsonl')
+    with RecordedTrio('10.0.0.1', record=session) as t:
+        t.commandI("?42")
+
+    r = atrio.Trio('10.0.0.1', replay=session)
+    with pytest.raises(atrio.AtrioError, match="diverged"):
+        r.command("?43")
+
+
+def test_replay_dropped_link(tmp_path):
+    session = str(tmp_path / 'session.jsonl')
+    with RecordedTrio('10.0.0.1', record=session) as t:
+        t.commandI("?42")
+        t.t.telnet.alive = False
+        with pytest.raises(atrio.ConnectionLost):
+            t.command("?1")
+        t.connect()  # Recorded: send ?1 then open, with no answer in between
+        assert t.commandI("?2") == 2
+
+    r = atrio.Trio('10.0.0.1', replay=session)
+    assert r.commandI("?42") == 42
+    with pytest.raises(atrio.ConnectionLost):
+        r.command("?1")
+    r.connect()
+    assert r.commandI("?2") == 2
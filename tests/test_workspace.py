@@ -0,0 +1,140 @@
+import pytest
+import yaml
+
+import atrio
+
+
+@pytest.fixture
+def workspace(tmp_path, fake_trio):
+    files = []
+    for name, autorun in [('A', None), ('B', 2)]:
+        with open(tmp_path / (name + '.BAS'), 'w', newline='\r\n') as f:
+            f.write(''.join("PRINT \"{} {}\"\n".format(name, i) for i in range(5)))
+        files.append({'filename': name + '.BAS', 'autorun': autorun})
+    wsfile = tmp_path / 'ws.yaml'
+    with open(wsfile, 'w') as f:
+        yaml.dump({'files': files}, f)
+    ws = atrio.Workspace(fake_trio)
+    ws.load(str(wsfile))
+    return ws
+
+
+def written_lines(trio, progname):
+    return [c for c in trio.commands if c.startswith('!{},'.format(progname)) and 'R' in c]
+
+
+def test_upload(workspace):
+    assert workspace.write_to_controller(auto_restart=False) == 10
+    programs = workspace.trio.programs
+    assert programs['A']['lines'][4] == b'PRINT "A 4"'
+    assert programs['B']['autorun'] == 2
+    assert workspace.write_to_controller(auto_restart=False) == 0
+
+
+def test_upload_resumes_from_checkpoint(workspace, tmp_path):
+    trio = workspace.trio
+    # Dry run on another controller to find when the third line of B is written
+    dry = atrio.Workspace(type(trio)())
+    dry.load(str(tmp_path / 'ws.yaml'))
+    dry.write_to_controller(auto_restart=False)
+    fail_at = dry.trio.commands.index('!B,2RPRINT "B 2"') + 1
+
+    # Drop the connection there
+    trio.fail_at = [fail_at]
+    with pytest.raises(atrio.AtrioError):
+        workspace.write_to_controller(auto_restart=False)
+    cp = workspace.checkpoint
+    assert cp['plan'][cp['step']]['filename'] == workspace.wsfiledir / 'B.BAS'
+    assert cp['lines'] == 2
+
+    trio.commands.clear()
+    trio.fail_at = []
+    trio.connect()
+    assert workspace.write_to_controller(auto_restart=False) == 10
+    assert written_lines(trio, 'A') == []
+    assert len(written_lines(trio, 'B')) == 5 - 2
+    assert trio.programs['B']['lines'] == [b'PRINT "B %d"' % i for i in range(5)]
+    assert workspace.checkpoint is None
+
+
+def test_plan_deploy(workspace, tmp_path):
+    with open(tmp_path / 'MC_CONFIG.MCC', 'w') as f:
+        f.write("AXIS(0)\n")
+    workspace.ws['files'].append({'filename': 'MC_CONFIG.MCC', 'autorun': None})
+    workspace.trio.programs['OLD'] = {'type': 0, 'lines': [], 'autorun': None}
+    plan = workspace.plan_deploy(workspace.controller_diff())
+    assert [s['action'] for s in plan] == ['delete', 'upload', 'upload', 'upload', 'autorun', 'autorun', 'restart']
+    assert plan[1]['filename'].name == 'MC_CONFIG.MCC'
+    assert len(plan[-1]['reasons']) == 2
+
+
+def test_removing_autorun_needs_no_restart(workspace):
+    workspace.write_to_controller(auto_restart=False)
+    workspace.ws['files'][1]['autorun'] = None
+    plan = workspace.plan_deploy(workspace.controller_diff())
+    assert [s['action'] for s in plan] == ['autorun']
+    assert workspace.write_to_controller(auto_restart=False) == 1
+    assert workspace.trio.programs['B']['autorun'] is None
+
+
+def test_files_prepared_once(workspace, monkeypatch):
+    from atrio import workspace as workspace_module
+    prepared = []
+    prepare_file = workspace_module.prepare_file
+    monkeypatch.setattr(workspace_module, 'prepare_file', lambda f: prepared.append(f) or prepare_file(f))
+    workspace.trio.programs['A'] = {'type': 0, 'lines': [b'old'], 'autorun': None}
+    workspace.write_to_controller(auto_restart=False)
+    assert sorted(p.name for p in prepared) == ['A.BAS', 'B.BAS']
+    assert set(workspace.timings) >= {'diff', 'prepare', 'wait', 'upload'}
+    workspace.print_timings()
+
+
+def test_upload_without_halt_stops_rewritten_programs(workspace):
+    trio = workspace.trio
+    trio.programs['A'] = {'type': 0, 'lines': [b'old'], 'autorun': None}
+    trio.programs['OLD'] = {'type': 0, 'lines': [], 'autorun': None}
+    workspace.write_to_controller(auto_restart=False, halt=False)
+    assert 'HALT' not in trio.commands
+    assert trio.commands.index('STOP "OLD"') < trio.commands.index('DEL "OLD"')
+    assert trio.commands.index('STOP "A"') < trio.commands.index('DEL "A"')
+    assert 'STOP "B"' not in trio.commands  # Not in the controller yet
+
+
+def test_files_prepared_before_listing_controller(workspace, monkeypatch):
+    import threading
+    from atrio import workspace as workspace_module
+    events = []
+    started = threading.Event()
+    prepare_file = workspace_module.prepare_file
+
+    def prepare(f):
+        events.append('prepare')
+        started.set()
+        return prepare_file(f)
+    monkeypatch.setattr(workspace_module, 'prepare_file', prepare)
+    list_files = workspace.trio.list_files
+
+    def listing():
+        started.wait(1)
+        events.append('DIR')
+        return list_files()
+    monkeypatch.setattr(workspace.trio, 'list_files', listing)
+    workspace.controller_diff()
+    assert events[0] == 'prepare'
+
+
+def test_check_non_utf8_file(workspace):
+    with open(workspace.wsfiledir / 'A.BAS', 'wb') as f:
+        f.write(b"PRINT \"caf\xe9\"\r\n")
+    diff = workspace.controller_diff()
+    assert diff['missing'] == [workspace.wsfiledir / 'A.BAS', workspace.wsfiledir / 'B.BAS']
+    assert workspace.prepared[workspace.wsfiledir / 'A.BAS']['crc'] == atrio.crc_file(workspace.wsfiledir / 'A.BAS')
+
+
+def test_other_errors_drop_checkpoint(workspace, monkeypatch):
+    def autorun_program(progname, process):
+        raise atrio.AtrioError("Trio fake (cmd: b'RUNTYPE') bad return code")
+    monkeypatch.setattr(workspace.trio, 'autorun_program', autorun_program)
+    with pytest.raises(atrio.AtrioError):
+        workspace.write_to_controller(auto_restart=False)
+    assert workspace.checkpoint is None